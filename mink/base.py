@@ -2,25 +2,39 @@
 
 from collections import defaultdict
 from collections import OrderedDict
+import itertools
+import os
+import pickle
 import time
+import weakref
 
 import numpy as np
 from sklearn.base import BaseEstimator
+from sklearn.base import ClassifierMixin
+from sklearn.base import RegressorMixin
 from sklearn.base import TransformerMixin
+from sklearn.base import is_classifier
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import LabelBinarizer
 import tensorflow as tf
+from tensorflow.python.framework import graph_util
 
 from mink import handlers
 from mink import nonlinearities
 from mink import objectives
 from mink.config import floatX
+from mink.config import intX
+from mink.data import as_array
 from mink.iterators import IteratorPipeline
 from mink.layers import DenseLayer
 from mink.updates import SGD
 from mink.utils import get_all_layers
+from mink.utils import get_hyperparams
 from mink.utils import get_input_layers
 from mink.utils import get_layer_name
+from mink.utils import get_layer_scopes
+from mink.utils import get_shape
+from mink.utils import layer_scope
 from mink.utils import set_named_layer_param
 
 flags = tf.app.flags
@@ -28,6 +42,9 @@ flags = tf.app.flags
 
 __all__ = ['make_network', 'NeuralNetClassifier', 'NeuralNetRegressor']
 
+# alignment in bytes of the arrays in a saved weights file
+_ALIGNMENT = 64
+
 
 def _name_layers(layer_lst):
     """Generate names for layers.
@@ -60,6 +77,41 @@ def make_network(layers_lst):
     return Pipeline(_name_layers(layers_lst))
 
 
+def _first_rows(Xs, num_rows):
+    """Symbolically slice the first `num_rows` rows of `Xs`."""
+    ndim = len(get_shape(Xs))
+    size = tf.pack([num_rows] + [-1] * (ndim - 1))
+    return tf.slice(Xs, [0] * ndim, size)
+
+
+def _timed(iterable, durations):
+    """Yield the items of the iterable, appending the time it took to
+    produce each of them to `durations`.
+
+    """
+    iterator = iter(iterable)
+    while True:
+        tic = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        durations.append(time.perf_counter() - tic)
+        yield item
+
+
+def _iter_with_lengths(batches):
+    """Pair each batch with the number of its rows that are not
+    padding.
+
+    """
+    get_lengths = getattr(batches, 'batch_lengths', None)
+    lengths = get_lengths() if get_lengths else []
+    for i, (Xb, yb) in enumerate(batches):
+        num_valid = lengths[i] if i < len(lengths) else len(Xb)
+        yield Xb, yb, num_valid
+
+
 # pylint: disable=super-init-not-called,too-many-arguments
 # pylint: disable=too-many-instance-attributes
 class NeuralNetBase(BaseEstimator, TransformerMixin):
@@ -82,6 +134,9 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
             on_training_started,
             on_epoch_finished,
             verbose,
+            steps_per_run,
+            cache_data,
+            time_batches,
     ):
         self.layer = layer
         self.update = update
@@ -94,6 +149,9 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
         self.on_training_started = on_training_started
         self.on_epoch_finished = on_epoch_finished
         self.verbose = verbose
+        self.steps_per_run = steps_per_run
+        self.cache_data = cache_data
+        self.time_batches = time_batches
 
     def initialize(self, X=None, y=None):
         """TODO"""
@@ -105,6 +163,37 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
         if getattr(self, '_initialized', None):
             return
 
+        # Each net builds its ops in a graph of its own, so that
+        # fitting many nets does not grow the default graph.
+        with self._get_graph().as_default():
+            self._initialize(X, y)
+
+    def _get_graph(self):
+        graph = getattr(self, 'graph_', None)
+        if graph is None:
+            graph = tf.Graph()
+            self.graph_ = graph
+        if getattr(self, '_initialized', None):
+            return graph
+
+        for layer in get_all_layers(self.layer):
+            owner = getattr(layer, 'net_', None)
+            owner = owner() if owner is not None else None
+            if (owner is not None) and (owner is not self) and getattr(
+                    owner, '_initialized', None):
+                raise ValueError(
+                    "Layer {} is used by another initialized net. Use "
+                    "separate layers for each net (e.g. through "
+                    "sklearn.base.clone), or close the other net "
+                    "first.".format(get_layer_name(layer)))
+            params = getattr(layer, 'params_', {})
+            if any(param.graph is not graph for param in params.values()):
+                # the layer was built in a graph that is closed or gone,
+                # build it anew
+                layer._clear()
+        return graph
+
+    def _initialize(self, X, y):
         input_shapes = self._get_input_shapes(X)
         if y is None:
             # Assumes that net is initialiazed already
@@ -126,15 +215,25 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
             layer = self.layer
 
         self._initialize_output_layer(layer, output_shape)
+        self._set_layer_scopes()
         layer.initialize(Xs, ys, deterministic=deterministic)
         ys_ff = layer.get_output(Xs, deterministic=deterministic)
-        loss = self.objective(ys, ys_ff)
-        train_step = self.update(loss)
+        # padded rows of a batch are excluded from the loss
+        num_valid = tf.placeholder_with_default(tf.shape(ys)[0], shape=[])
+        loss = self.objective(
+            _first_rows(ys, num_valid),
+            _first_rows(ys_ff, num_valid),
+        )
+        optimizer = self.update.get_optimizer()
+        train_step = optimizer.minimize(loss)
 
-        if self.session_kwargs:
-            session = tf.Session(**self.session_kwargs)
+        if self.steps_per_run > 1:
+            multi_step = self._get_multi_step(
+                layer, optimizer, Xs, ys, deterministic)
         else:
-            session = tf.Session()
+            multi_step = None, None, None, None
+
+        session = self._new_session()
         # TODO: Only initialize required variables?
         session.run(tf.initialize_all_variables())
 
@@ -152,6 +251,7 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
         if tensorboard_logs:
             tf.histogram_summary('train activity', ys_ff)
             tf.scalar_summary('train loss', loss)
+        summary = tf.merge_all_summaries()
 
         if y is not None and self.encoder:
             self.encoder.fit(y)
@@ -160,18 +260,37 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
 
         self.session_ = session
         self.tensorboard_logs_ = tensorboard_logs
+        self.summary_ = summary
         self.loss_ = loss
         self.train_step_ = train_step
         self.Xs_ = Xs
         self.ys_ = ys
         self.deterministic_ = deterministic
+        self.num_valid_ = num_valid
         self.feed_forward_ = ys_ff
+        self.layer_params_ = [dict(getattr(layer, 'params_', {}))
+                              for layer in get_all_layers(self.layer)]
+        (self.Xs_multi_, self.ys_multi_, self.loss_multi_,
+         self.train_step_multi_) = multi_step
+        self.hyperparams_ = get_hyperparams(
+            [self.update] + get_all_layers(self.layer), self.graph_)
         self.train_history_ = []
+        # the layers remember the net they belong to, so that they
+        # cannot be taken over by another net while this one is in use
+        for layer in get_all_layers(self.layer):
+            layer.net_ = weakref.ref(self)
         self._initialized = True
 
     def _initialize_output_layer(self, layer, output_shape):
         raise NotImplementedError
 
+    def _set_layer_scopes(self):
+        """Give each layer a unique scope to build its ops in."""
+        all_layers = get_all_layers(self.layer)
+        self.layer_scopes_ = get_layer_scopes(all_layers)
+        for layer, scope in zip(all_layers, self.layer_scopes_):
+            layer.scope_ = scope
+
     def _initialize_callbacks(self):
         self.on_training_started_ = self.on_training_started or []
         if not any([isinstance(handler, handlers.PrintLayerInfo)
@@ -183,9 +302,11 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
                     for handler in self.on_epoch_finished]):
             self.on_epoch_finished_.append(handlers.PrintTrainProgress())
 
+        # callbacks may also be plain functions
         for callbacks in [self.on_training_started_, self.on_epoch_finished_]:
             for handler in callbacks:
-                handler._clear()
+                if isinstance(handler, handlers.Handler):
+                    handler._clear()
 
     def _get_input_shapes(self, X):
         if X is None:
@@ -198,7 +319,7 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
                     "Please initialize the net with data, "
                     "e.g. net.initialiize(X, y).")
         else:
-            if isinstance(X, np.ndarray):
+            if not isinstance(X, (list, tuple)):
                 X = [X]
             input_shapes = [[None] + list(x.shape[1:]) for x in X]
 
@@ -215,6 +336,12 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
             raise ValueError("Multiple input layers not supported yet.")
         input_layer = input_layers[0]
 
+        if self.cache_data:
+            if (input_layer.Xs is not None) or (input_layer.ys is not None):
+                raise ValueError("cache_data is only supported if the "
+                                 "input layer is fed by mink.")
+            return self._get_data_cache(input_shapes[0], output_shape)
+
         Xs = input_layer.Xs if input_layer.Xs is not None else tf.placeholder(
             dtype=floatX,
             shape=input_shapes[0],
@@ -225,6 +352,160 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
         )
         return Xs, ys
 
+    def _get_data_cache(self, input_shape, output_shape):
+        """Create variables that hold the whole training data on the
+        device and return symbolic variables for gathering a batch
+        from them.
+
+        The variables are excluded from the variable collections, so
+        that they are neither initialized with the other variables
+        nor part of the parameters; they are loaded by `fit` whenever
+        it is called with other data than before. For predictions, the
+        gathered batch is fed directly.
+
+        The `shuffle`, `random_state` and `last_batch='drop'` settings
+        of the training batch iterator are honoured, by feeding the
+        order of the samples once per epoch.
+
+        """
+        iterator = self.batch_iterator_train
+        if isinstance(iterator, IteratorPipeline) and iterator.steps:
+            raise ValueError("cache_data does not support batch iterators "
+                             "with transform steps.")
+        if getattr(iterator, 'last_batch', 'keep') == 'pad':
+            raise ValueError("cache_data does not support batch iterators "
+                             "with last_batch='pad'.")
+
+        X_init = tf.placeholder(dtype=floatX, shape=input_shape)
+        y_init = tf.placeholder(dtype=floatX, shape=output_shape)
+        X_data = tf.Variable(
+            X_init, trainable=False, collections=[], validate_shape=False)
+        y_data = tf.Variable(
+            y_init, trainable=False, collections=[], validate_shape=False)
+        indices = tf.Variable(
+            tf.range(tf.shape(X_init)[0]),
+            trainable=False,
+            collections=[],
+            validate_shape=False,
+        )
+
+        order = tf.placeholder(dtype=intX, shape=[None])
+
+        self.data_init_ = X_init, y_init
+        self.data_load_ = [X_data.initializer, y_data.initializer,
+                           indices.initializer]
+        self.data_loaded_ = None
+        self.data_order_ = order
+        self.data_shuffle_ = tf.assign(indices, order, validate_shape=False)
+        self.data_ = X_data, y_data, indices
+        self.batch_start_ = tf.placeholder(dtype=intX, shape=[])
+        self.batch_size_ = tf.placeholder(dtype=intX, shape=[])
+        return self._gather_batch(0)
+
+    def _gather_batch(self, step):
+        """Gather the `step`-th batch, counted from `batch_start_`,
+        from the cached data.
+
+        """
+        X_data, y_data, indices = self.data_
+        start = self.batch_start_ + step * self.batch_size_
+        batch_indices = tf.slice(indices, [start], [self.batch_size_])
+
+        Xs = tf.gather(X_data, batch_indices)
+        Xs.set_shape(self.data_init_[0].get_shape())
+        ys = tf.gather(y_data, batch_indices)
+        ys.set_shape(self.data_init_[1].get_shape())
+        return Xs, ys
+
+    def _load_data_cache(self, X, y):
+        # X is compared by identity, thus it should not be modified in
+        # place between calls
+        loaded = self.data_loaded_
+        if (loaded is not None) and (loaded[0] is X) and (
+                np.array_equal(loaded[1], y)):
+            return
+
+        X_init, y_init = self.data_init_
+        self.session_.run(
+            self.data_load_,
+            feed_dict={X_init: X, y_init: y},
+        )
+        self.data_loaded_ = X, y
+
+    def _get_multi_step(self, layer, optimizer, Xs, ys, deterministic):
+        """Unroll `steps_per_run` optimizer steps so that they can be
+        executed by a single call to `session.run`.
+
+        Each step gets its own slice of a stacked input placeholder
+        (or of the cached data) and reads all variables, i.e. the
+        parameters as well as the variables of the optimizer (such as
+        Adam's powers of beta), only after the previous step has
+        updated them. All steps share the same optimizer, and thus its
+        variables, with the single step `train_step_`, so that
+        `steps_per_run` fused steps are equivalent to as many single
+        steps.
+
+        """
+        num_steps = self.steps_per_run
+        input_layer = get_input_layers(self.layer)[0]
+        if input_layer.Xs is not None:
+            raise ValueError("steps_per_run > 1 is only supported if the "
+                             "input layer is fed by mink.")
+
+        all_layers = get_all_layers(self.layer)
+        params = {param for l in all_layers
+                  for param in getattr(l, 'params_', {}).values()}
+        if any(var not in params for var in tf.trainable_variables()):
+            raise ValueError("steps_per_run > 1 is only supported if all "
+                             "variables are registered as layer params, "
+                             "which is not the case for recurrent layers.")
+
+        if self.cache_data:
+            Xs_multi, ys_multi = None, None
+            step_inputs = [self._gather_batch(k) for k in range(num_steps)]
+        else:
+            Xs_multi = tf.placeholder(
+                dtype=floatX,
+                shape=(num_steps,) + get_shape(Xs)[1:],
+            )
+            ys_multi = tf.placeholder(
+                dtype=floatX,
+                shape=(num_steps,) + get_shape(ys)[1:],
+            )
+            step_inputs = zip(tf.unpack(Xs_multi, num=num_steps),
+                              tf.unpack(ys_multi, num=num_steps))
+
+        # Ops read a variable through its snapshot, which is only
+        # evaluated once per run. While the steps are built, the
+        # snapshots are replaced by reads that happen after the
+        # previous step.
+        # pylint: disable=protected-access
+        variables = tf.all_variables()
+        snapshots = [variable._snapshot for variable in variables]
+
+        losses = []
+        train_step = tf.no_op()
+        try:
+            for Xs_k, ys_k in step_inputs:
+                with tf.control_dependencies([train_step]):
+                    Xs_k = tf.identity(Xs_k)
+                    ys_k = tf.identity(ys_k)
+                    for variable in variables:
+                        variable._snapshot = tf.identity(variable.ref())
+
+                input_layer.fit(Xs_k)
+                ys_ff_k = layer.get_output(Xs_k, deterministic=deterministic)
+                loss_k = self.objective(ys_k, ys_ff_k)
+                train_step = optimizer.minimize(loss_k)
+                losses.append(loss_k)
+        finally:
+            # restore the original graph inputs and snapshots
+            input_layer.fit(Xs, ys)
+            for variable, snapshot in zip(variables, snapshots):
+                variable._snapshot = snapshot
+
+        return Xs_multi, ys_multi, tf.pack(losses), train_step
+
     def _get_iterators(self):
         if isinstance(self.batch_iterator_train, int):
             batch_iterator_train = IteratorPipeline(
@@ -243,22 +524,34 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
             batch_iterator_test = self.batch_iterator_test
         return batch_iterator_train, batch_iterator_test
 
-    def fit(self, X, yt, epochs=None):
-        """TODO"""
+    @staticmethod
+    def _prepare_y(yt):
+        yt = np.asarray(as_array(yt))
         if yt.ndim == 1:
             yt = yt.reshape(-1, 1)
+        return yt
 
-        self.initialize(X, yt)
-
+    def _encode_y(self, yt):
         if self.encoder:
             y = self.encoder.transform(yt)
             if y.shape[1] == 1:  # binary classification:
                 y = np.hstack((1.0 - y, y))
         else:
             y = yt
+        return y
+
+    def fit(self, X, yt, epochs=None):
+        """TODO"""
+        X = as_array(X)
+        yt = self._prepare_y(yt)
+
+        self.initialize(X, yt)
+        y = self._encode_y(yt)
 
         self.batch_iterator_train_.fit(X, y)
         self.batch_iterator_test_.fit(X, y)
+        if self.cache_data:
+            self._load_data_cache(X, y)
 
         if epochs is None:
             epochs = self.max_epochs
@@ -266,63 +559,444 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
         for callback in self.on_training_started:
             callback(self)
 
+        # handlers may restore an earlier state, e.g. from a checkpoint
+        callbacks = [callback for callback in self.on_epoch_finished or ()
+                     if isinstance(callback, handlers.Handler)]
+        epochs_done = max(
+            [callback._resume(self) for callback in callbacks], default=0)
         try:
-            self.train_loop(X, y, epochs=epochs)
+            self.train_loop(X, y, epochs=epochs, start_epoch=epochs_done)
         except KeyboardInterrupt:
             pass
+        finally:
+            for callback in callbacks:
+                callback._finish(self)
+        return self
+
+    def _initialize_incremental(self, X, yt, classes):
+        """Initialize the net from the first chunk of data when
+        training incrementally.
+
+        """
+        if getattr(self, '_initialized', None):
+            return
+
+        if self.encoder and (classes is None):
+            raise ValueError("classes must be passed on the first call "
+                             "to partial_fit or fit_generator.")
+        if classes is None:
+            y_init = yt
+        else:
+            y_init = np.asarray(classes).reshape(-1, 1)
+
+        self.initialize(X, y_init)
+        y = self._encode_y(yt)
+        self.batch_iterator_train_.fit(X, y)
+        self.batch_iterator_test_.fit(X, y)
+
+        for callback in self.on_training_started:
+            callback(self)
+
+    def fit_generator(self, batches, classes=None):
+        """Train on a stream of `(Xb, yb)` batches.
+
+        Performs one update step per batch, applying the transform
+        steps of the training batch iterator, and records a single
+        epoch in `train_history_`. The net is initialized from the
+        first batch if necessary; in that case, classifiers require
+        all `classes` to be passed.
+
+        """
+        batches = iter(batches)
+        try:
+            Xb, yb = next(batches)
+        except StopIteration:
+            return self
+
+        self._initialize_incremental(Xb, self._prepare_y(yb), classes)
+        batches = itertools.chain([(Xb, yb)], batches)
+
+        try:
+            self._train_epoch(
+                self._iter_batch_feeds(batches),
+                epoch=len(self.train_history_),
+            )
+        except (KeyboardInterrupt, handlers.StopTraining):
+            pass
         return self
 
-    def train_loop(self, X, y, epochs):
+    def partial_fit(self, X, yt, classes=None, epochs=1):
+        """Train incrementally on a chunk of data.
+
+        Performs `epochs` passes (by default, a single one) over the
+        chunk. Unlike `fit`, the label encoder and the batch iterators
+        are only fitted on the first call, which initializes the net;
+        in that case, classifiers require all `classes` to be passed.
+
+        """
+        X = as_array(X)
+        yt = self._prepare_y(yt)
+        self._initialize_incremental(X, yt, classes)
+
+        if self.encoder:
+            unknown = np.setdiff1d(np.unique(yt), self.encoder.classes_)
+            if unknown.size:
+                raise ValueError("Labels {} were not among the classes "
+                                 "passed on the first call.".format(unknown))
+
+        y = self._encode_y(yt)
+        if self.cache_data:
+            self._load_data_cache(X, y)
+
+        try:
+            for _ in range(epochs):
+                self._train_epoch(
+                    self._iter_train_feeds(X, y),
+                    epoch=len(self.train_history_),
+                )
+        except (KeyboardInterrupt, handlers.StopTraining):
+            pass
+        return self
+
+    def _iter_batch_feeds(self, batches):
+        transform = self.batch_iterator_train_.transform
+        batches = iter(batches)
+        while True:
+            tic = time.perf_counter()
+            try:
+                Xb, yb = next(batches)
+            except StopIteration:
+                return
+            Xb, yb = transform(Xb, self._encode_y(self._prepare_y(yb)))
+            yield ({self.Xs_: Xb, self.ys_: yb}, [len(Xb)], False,
+                   time.perf_counter() - tic)
+
+    def _iter_test_batches(self, X, batch_iterator=None):
+        """Yield the transformed test batches of `X`, which may be an
+        array-like, a path, or an iterable of batches, together with
+        the number of their rows that are not padding.
+
+        """
+        batch_iterator = batch_iterator or self.batch_iterator_test_
+        X = as_array(X)
+        if hasattr(X, 'shape'):
+            batches = batch_iterator(X)
+            for Xb, _, num_valid in _iter_with_lengths(batches):
+                yield Xb, num_valid
+            return
+
+        transform = batch_iterator.transform
+        for Xb in X:
+            Xb = transform(Xb)[0]
+            yield Xb, len(Xb)
+
+    def _iter_forward(self, X, session=None, batch_iterator=None):
+        """Yield the output of the net batch by batch.
+
+        By default, the session and the test iterator of the net are
+        used.
+
+        """
+        session = session or self.session_
+        for Xb, num_valid in self._iter_test_batches(X, batch_iterator):
+            feed_dict = {self.Xs_: Xb, self.deterministic_: True}
+            y_out = session.run(self.feed_forward_, feed_dict=feed_dict)
+            yield y_out[:num_valid]
+
+    def _forward(self, X, out=None, session=None, batch_iterator=None):
+        """Compute the output of the net for all of `X`.
+
+        The output array is allocated once (unless `out` is given) and
+        each batch is written into its slice of it.
+
+        """
+        X = as_array(X)
+        batches = self._iter_forward(X, session, batch_iterator)
+        if not hasattr(X, 'shape'):
+            # stream of batches, the number of rows is not known
+            y_out = np.vstack(list(batches))
+            if out is None:
+                return y_out
+            out[...] = y_out
+            return out
+
+        num_rows = X.shape[0]
+        start = 0
+        for yb in batches:
+            if out is None:
+                out = np.empty((num_rows,) + yb.shape[1:], dtype=yb.dtype)
+            elif out.shape[1:] != yb.shape[1:]:
+                raise ValueError("out has shape {}, expected {}.".format(
+                    out.shape, (num_rows,) + yb.shape[1:]))
+            out[start:start + len(yb)] = yb
+            start += len(yb)
+
+        if out is None:
+            shape = [dim or 0 for dim in get_shape(self.feed_forward_)]
+            out = np.empty([num_rows] + shape[1:], dtype=np.float32)
+        if (start != num_rows) or (len(out) != num_rows):
+            raise ValueError("Expected output for {} samples, got {} "
+                             "into an array of length {}.".format(
+                                 num_rows, start, len(out)))
+        return out
+
+    def train_loop(self, X, y, epochs, start_epoch=0):
         """TODO"""
-        summary = tf.merge_all_summaries()
+        for epoch in range(start_epoch, epochs):
+            try:
+                self._train_epoch(self._iter_train_feeds(X, y), epoch)
+            except handlers.StopTraining:
+                break
+        return self
+
+    def _train_epoch(self, feed_dicts, epoch):
+        """Perform one training step per feed dict and run the epoch
+        callbacks.
+
+        """
+        summary = self.summary_
         inputs = [self.train_step_, self.loss_]
-        state = {}
         if summary is not None:
             inputs += [summary]
 
-        for epoch in range(epochs):
-            train_losses = []
-            tic = time.time()
-            state['epoch'] = epoch
-            state['train_losses'] = train_losses
-            state['tic'] = tic
-
-            for Xb, yb in self.batch_iterator_train_(X, y):
-                feed_dict = {
-                    self.Xs_: Xb,
-                    self.ys_: yb,
-                    self.deterministic_: False,
-                }
-
+        train_losses = []
+        batch_sizes = []
+        state = {
+            'epoch': epoch,
+            'train_losses': train_losses,
+            'train_batch_sizes': batch_sizes,
+            'tic': time.time(),
+        }
+        logs = None
+        hyperparams = self._get_hyperparam_feed_dict()
+
+        profilers = [handler for handler in self.on_epoch_finished or ()
+                     if isinstance(handler, handlers.StepProfiler)]
+
+        if self.time_batches:
+            timings = OrderedDict(
+                (key, []) for key in ['iterator', 'feed', 'run', 'samples'])
+            durations = []
+            feed_dicts = _timed(feed_dicts, durations)
+            state['timings'] = timings
+
+        for feed_dict, sizes, is_multi, iterator_time in feed_dicts:
+            tic = time.perf_counter()
+            feed_dict[self.deterministic_] = False
+            feed_dict.update(hyperparams)
+            batch_sizes.extend(sizes)
+            fetches = inputs
+            if is_multi:
+                fetches = [self.train_step_multi_, self.loss_multi_]
+            toc = time.perf_counter()
+
+            tracing = [profiler for profiler in profilers
+                       if profiler._start_step()]
+            if tracing:
+                run_metadata = tf.RunMetadata()
                 output = self.session_.run(
-                    inputs,
+                    fetches,
                     feed_dict=feed_dict,
+                    options=tf.RunOptions(
+                        trace_level=tf.RunOptions.FULL_TRACE),
+                    run_metadata=run_metadata,
                 )
-                if summary is not None:
-                    _, loss, logs = output
-                else:
-                    _, loss = output
-                    logs = None
+                for profiler in tracing:
+                    profiler._add_trace(run_metadata, self.layer_scopes_)
+            else:
+                output = self.session_.run(
+                    fetches,
+                    feed_dict=feed_dict,
+                )
+            if self.time_batches:
+                # the time spent in the batch iterator is not part of
+                # building the feed dict
+                timings['iterator'].append(iterator_time)
+                timings['feed'].append(
+                    durations.pop() - iterator_time + toc - tic)
+                timings['run'].append(time.perf_counter() - toc)
+                timings['samples'].append(sum(sizes))
+
+            if is_multi:
+                train_losses.extend(output[1])
+                continue
+
+            if summary is not None:
+                _, loss, logs = output
+            else:
+                _, loss = output
+                logs = None
 
-                train_losses.append(loss)
+            train_losses.append(loss)
 
-            if logs:
-                self.tensorboard_logs_.add_summary(logs, epoch)
-            if self.verbose:
-                self._callback_on_epoch_finished(state)
+        if logs:
+            self.tensorboard_logs_.add_summary(logs, epoch)
+        self._callback_on_epoch_finished(state)
 
-        return self
+    def _get_hyperparam_feed_dict(self):
+        # hyperparameters may have been changed through set_params
+        return {placeholder: getattr(obj, name)
+                for obj, name, placeholder in self.hyperparams_}
+
+    def _iter_train_feeds(self, X, y):
+        """Yield the feed dicts for one epoch of training, together
+        with the number of samples per step, a flag indicating whether
+        they are meant for the multi-step training ops, and the time
+        spent waiting for the batch iterator.
+
+        """
+        if not self.cache_data:
+            durations = []
+            batches = self._iter_train_batches(X, y, durations)
+            for Xb, yb, num_valid, is_multi in batches:
+                iterator_time = sum(durations)
+                del durations[:]
+                if is_multi:
+                    feed_dict = {self.Xs_multi_: Xb, self.ys_multi_: yb}
+                    yield (feed_dict, [num_valid] * len(Xb), True,
+                           iterator_time)
+                    continue
+
+                feed_dict = {self.Xs_: Xb, self.ys_: yb}
+                if num_valid < len(Xb):
+                    feed_dict[self.num_valid_] = num_valid
+                yield feed_dict, [num_valid], False, iterator_time
+            return
+
+        # the data already lives on the device, only the order of the
+        # samples and the batch boundaries are fed
+        iterator = self.batch_iterator_train_
+        num_samples = X.shape[0]
+        if getattr(iterator, 'shuffle', False):
+            order = iterator._draw_permutation(num_samples)
+        else:
+            order = np.arange(num_samples)
+        self.session_.run(
+            self.data_shuffle_, feed_dict={self.data_order_: order})
+
+        batch_size = iterator.batch_size
+        num_full = num_samples // batch_size
+        if getattr(iterator, 'last_batch', 'keep') == 'drop':
+            num_samples = num_full * batch_size
+        num_multi = 0
+        if self.steps_per_run > 1:
+            num_multi = num_full - num_full % self.steps_per_run
+
+        for i in range(0, num_multi, self.steps_per_run):
+            feed_dict = {
+                self.batch_start_: i * batch_size,
+                self.batch_size_: batch_size,
+            }
+            yield feed_dict, [batch_size] * self.steps_per_run, True, 0.0
+
+        for start in range(num_multi * batch_size, num_samples, batch_size):
+            size = min(batch_size, num_samples - start)
+            feed_dict = {
+                self.batch_start_: start,
+                self.batch_size_: size,
+            }
+            yield feed_dict, [size], False, 0.0
+
+    def _iter_train_batches(self, X, y, durations=None):
+        """Yield training batches together with the number of rows
+        that are not padding and a flag indicating whether they
+        consist of `steps_per_run` stacked batches.
+
+        Only consecutive unpadded batches of the same shape are
+        stacked, the remaining ones (e.g. a smaller or padded last
+        batch) are yielded individually.
+
+        If a list of `durations` is given, the time it took the batch
+        iterator to produce each batch is appended to it.
+
+        """
+        batches = _iter_with_lengths(self.batch_iterator_train_(X, y))
+        if durations is not None:
+            batches = _timed(batches, durations)
+        if self.steps_per_run <= 1:
+            for Xb, yb, num_valid in batches:
+                yield Xb, yb, num_valid, False
+            return
+
+        # Batches are copied into the stacked arrays right away, since
+        # the iterator may reuse its batch buffers.
+        num_steps = self.steps_per_run
+        Xbs, ybs, num_pending = None, None, 0
+        for Xb, yb, num_valid in batches:
+            is_padded = num_valid < len(Xb)
+            if num_pending and (
+                    is_padded or
+                    (Xb.shape != Xbs.shape[1:]) or
+                    (yb.shape != ybs.shape[1:])):
+                for k in range(num_pending):
+                    yield Xbs[k], ybs[k], len(Xbs[k]), False
+                num_pending = 0
+
+            if is_padded:
+                yield Xb, yb, num_valid, False
+                continue
+
+            if not num_pending:
+                Xbs = np.empty((num_steps,) + Xb.shape, dtype=Xb.dtype)
+                ybs = np.empty((num_steps,) + yb.shape, dtype=yb.dtype)
+
+            Xbs[num_pending] = Xb
+            ybs[num_pending] = yb
+            num_pending += 1
+            if num_pending == num_steps:
+                yield Xbs, ybs, len(Xb), True
+                num_pending = 0
+
+        for k in range(num_pending):
+            yield Xbs[k], ybs[k], len(Xbs[k]), False
 
     def _callback_on_epoch_finished(self, state):
+        if state['train_losses']:
+            train_loss = np.average(
+                state['train_losses'],
+                weights=state['train_batch_sizes'],
+            )
+        else:
+            train_loss = np.nan
+
         info = OrderedDict([
             ('epoch', state['epoch'] + 1),
-            # TODO: should use np.average at some point
-            ('train loss', np.mean(state['train_losses'])),
+            ('train loss', train_loss),
             ('dur', time.time() - state['tic'])
         ])
+        if 'timings' in state:
+            self._add_batch_timings(info, state['timings'])
         self.train_history_.append(info)
+
+        # all handlers see the epoch, even if one of them stops training
+        stop = False
         for func in self.on_epoch_finished:
-            func(self)
+            try:
+                func(self)
+            except handlers.StopTraining:
+                stop = True
+        if stop:
+            raise handlers.StopTraining
+
+    def _add_batch_timings(self, info, timings):
+        """Store the timings of the batches of the last epoch in
+        `batch_timings_` and add their totals to the history.
+
+        """
+        # 'iterator' is the time spent waiting for the batch iterator
+        # (slicing and transform steps), 'feed' the time spent building
+        # the feed dict (including stacking batches for the multi-step
+        # ops) and 'run' the time spent in the session call, all in
+        # seconds.
+        self.batch_timings_ = OrderedDict(
+            (key, np.asarray(values)) for key, values in timings.items())
+        total = 0.0
+        for key in ['iterator', 'feed', 'run']:
+            info[key + ' time'] = self.batch_timings_[key].sum()
+            total += info[key + ' time']
+        num_samples = self.batch_timings_['samples'].sum()
+        info['samples/sec'] = num_samples / total if total else np.nan
+        info.move_to_end('dur')
 
     def predict(self, X):
         raise NotImplementedError
@@ -374,17 +1048,25 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
                 setattr(self, key, value)
         return self
 
+    def _get_layer_params(self):
+        # the variables this net was built with, even if its layers
+        # have since been built again by another net
+        if hasattr(self, 'layer_params_'):
+            return self.layer_params_
+        return [getattr(layer, 'params_', {})
+                for layer in get_all_layers(self.layer)]
+
     def get_all_params(self):
         """TODO"""
-        all_layers = get_all_layers(self.layer)
-        all_params = []
-        for layer in all_layers:
-            if not hasattr(layer, 'params_'):
-                params = {}
-            else:
-                params = {key: val.eval(self.session_) for key, val
-                          in layer.params_.items()}
-            all_params.append(params)
+        layer_params = self._get_layer_params()
+        keys = [(i, key) for i, params in enumerate(layer_params)
+                for key in params]
+        values = self._get_variable_values(
+            [layer_params[i][key] for i, key in keys])
+
+        all_params = [{} for _ in layer_params]
+        for (i, key), value in zip(keys, values):
+            all_params[i][key] = value
         return all_params
 
     def set_all_params(self, all_params):
@@ -394,44 +1076,262 @@ class NeuralNetBase(BaseEstimator, TransformerMixin):
         if len(all_layers) != len(all_params):
             raise ValueError("Networks don't seem to be the same.")
 
-        for layer, params in zip(all_layers, all_params):
-            layer_params = getattr(layer, 'params_', {})
-            for key, val in params.items():
-                if layer_params:
-                    layer.add_param(
-                        spec=layer.params_[key].assign(val),
-                        name=key,
-                        force=True,
-                    )
-                    # it appears that you have to eval for the effect
-                    # to take place
-                    layer.params_[key].eval(session=self.session_)
-                else:
-                    layer.add_param(
-                        spec=tf.Variable(val),
-                        name=key,
+        if getattr(self, '_initialized', None):
+            variables, values = [], []
+            for layer_params, params in zip(
+                    self._get_layer_params(), all_params):
+                for key, val in params.items():
+                    variables.append(layer_params[key])
+                    values.append(val)
+            self._set_variable_values(variables, values)
+            return
+
+        with self._get_graph().as_default():
+            self._set_layer_scopes()
+            for layer, params in zip(all_layers, all_params):
+                with layer_scope(layer):
+                    for key, val in params.items():
+                        layer.add_param(
+                            spec=tf.Variable(val, name=key.rstrip('_')),
+                            name=key,
+                        )
+
+    def _get_variables(self, trainable_only=False):
+        """All variables of the graph, including e.g. the slots of the
+        optimizer, or only those that are trained.
+
+        """
+        if trainable_only:
+            return self.graph_.get_collection(
+                tf.GraphKeys.TRAINABLE_VARIABLES)
+        return self.graph_.get_collection(tf.GraphKeys.VARIABLES)
+
+    def _get_variable_values(self, variables):
+        """Fetch the values of the variables with one session call."""
+        if not variables:
+            return []
+        return self.session_.run(list(variables))
+
+    def _get_assign_ops(self, variables):
+        """Return a (placeholder, assign op) pair per variable."""
+        # The assign ops are built only once per variable, so that
+        # restoring values repeatedly does not grow the graph.
+        assign_ops = self.__dict__.setdefault('assign_ops_', {})
+        with self.graph_.as_default():
+            for variable in variables:
+                if variable.name not in assign_ops:
+                    placeholder = tf.placeholder(
+                        dtype=variable.dtype.base_dtype,
+                        shape=variable.get_shape(),
                     )
+                    assign_ops[variable.name] = (
+                        placeholder, variable.assign(placeholder))
+        return [assign_ops[variable.name] for variable in variables]
 
-    def __getstate__(self):
+    def _set_variable_values(self, variables, values, session=None):
+        """Assign values to the variables with one session call, by
+        default in the session of the net.
+
+        """
+        fetches, feed_dict = [], {}
+        for (placeholder, assign), value in zip(
+                self._get_assign_ops(variables), values):
+            fetches.append(assign)
+            feed_dict[placeholder] = value
+        if fetches:
+            (session or self.session_).run(fetches, feed_dict=feed_dict)
+
+    def _new_session(self):
+        """Open a new session on the graph of the net."""
+        return tf.Session(graph=self.graph_, **(self.session_kwargs or {}))
+
+    def close(self):
+        """Close the session of the net and release its graph.
+
+        The net has to be initialized again before it can be used.
+
+        """
+        session = getattr(self, 'session_', None)
+        if session is not None:
+            session.close()
+        # stop the worker processes of the iterators, if any
+        for iterator in [getattr(self, 'batch_iterator_train_', None),
+                         getattr(self, 'batch_iterator_test_', None)]:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        for key in list(self.__dict__):
+            if key.endswith('_') or (key == '_initialized'):
+                del self.__dict__[key]
+
+    def __del__(self):
+        session = getattr(self, 'session_', None)
+        if session is not None:
+            session.close()
+
+    def save(self, path):
+        """Save the net to the directory `path`.
+
+        The architecture is pickled without the weights. The weights
+        are written to a single raw file, with every array aligned to
+        64 bytes, so that `load` can memory-map them.
+
+        """
+        os.makedirs(path, exist_ok=True)
+        index = []
+        offset = 0
+        with open(os.path.join(path, 'weights.bin'), 'wb') as f:
+            for i, params in enumerate(self.get_all_params()):
+                for key, val in sorted(params.items()):
+                    val = np.ascontiguousarray(val)
+                    padding = -offset % _ALIGNMENT
+                    f.write(b'\0' * padding)
+                    f.write(val.tobytes())
+                    offset += padding
+                    index.append((i, key, val.dtype.str, val.shape, offset))
+                    offset += val.nbytes
+
+        spec = {
+            'class': type(self),
+            'state': self._get_state_without_params(),
+            'initialized': bool(getattr(self, '_initialized', None)),
+            'weights': index,
+        }
+        with open(os.path.join(path, 'spec.pkl'), 'wb') as f:
+            pickle.dump(spec, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a net that was saved with `save`.
+
+        Parameters
+        ----------
+        path : str
+            The directory the net was saved to.
+
+        mmap_mode : str or None (default='r')
+            Mode used to memory-map the weights file, see
+            `numpy.memmap`. The weights are then read from the page
+            cache straight into the variables, without an intermediate
+            copy in memory. Note that the variables still hold a copy
+            of the weights in every process that loads the net; only
+            the file pages are shared. If None, the whole file is read
+            into memory first.
+
+        """
+        with open(os.path.join(path, 'spec.pkl'), 'rb') as f:
+            spec = pickle.load(f)
+
+        net = spec['class'].__new__(spec['class'])
+        net.__setstate__(spec['state'])
+        if not spec['initialized']:
+            return net
+
+        filename = os.path.join(path, 'weights.bin')
+        if not spec['weights']:
+            weights = np.empty(0, dtype=np.uint8)
+        elif mmap_mode:
+            weights = np.memmap(filename, dtype=np.uint8, mode=mmap_mode)
+        else:
+            weights = np.fromfile(filename, dtype=np.uint8)
+
+        all_params = [{} for _ in get_all_layers(net.layer)]
+        for i, key, dtype, shape, offset in spec['weights']:
+            all_params[i][key] = np.frombuffer(
+                weights,
+                dtype=dtype,
+                count=int(np.prod(shape)),
+                offset=offset,
+            ).reshape(shape)
+
+        net.initialize()
+        net.set_all_params(all_params)
+        return net
+
+    def export_inference(self, path):
+        """Write a frozen graph to `path` that only makes predictions.
+
+        The graph contains the forward pass in deterministic mode,
+        with the learned parameters folded in as constants. The
+        optimizer, the loss, the summaries and the target placeholder
+        are left out. The input of the graph is called 'mink_input',
+        its output 'mink_output'. For classifiers, 'mink_predict'
+        holds the predicted class indices. Load the graph with
+        `mink.inference.InferenceNet`.
+
+        """
+        output_names = self._get_inference_output_names()
+        graph_def = graph_util.convert_variables_to_constants(
+            self.session_,
+            self.graph_.as_graph_def(),
+            output_names,
+        )
+        with open(path, 'wb') as f:
+            f.write(graph_def.SerializeToString())
+
+    def _get_inference_output_names(self):
+        # built once, so that exporting again does not grow the graph
+        if hasattr(self, 'inference_output_names_'):
+            return self.inference_output_names_
+
+        input_layer = get_input_layers(self.layer)[0]
+        if input_layer.Xs is not None:
+            raise ValueError("export_inference is only supported if the "
+                             "input layer is fed by mink.")
+        if isinstance(self.layer, list):
+            layer = self.layer[-1]
+        else:
+            layer = self.layer
+
+        with self.graph_.as_default():
+            Xs = tf.placeholder(
+                dtype=floatX,
+                shape=get_shape(self.Xs_),
+                name='mink_input',
+            )
+            input_layer.fit(Xs)
+            try:
+                # recurrent layers create their variables through
+                # tensorflow's variable scopes, so reuse those
+                with tf.variable_scope(
+                        tf.get_variable_scope(), reuse=True):
+                    ys_ff = layer.get_output(Xs, deterministic=True)
+            finally:
+                input_layer.fit(self.Xs_, self.ys_)
+
+            output_names = [tf.identity(ys_ff, name='mink_output').op.name]
+            if is_classifier(self):
+                output_names.append(
+                    tf.argmax(ys_ff, 1, name='mink_predict').op.name)
+
+        self.inference_output_names_ = output_names
+        return output_names
+
+    def _get_state_without_params(self):
         state = dict(self.__dict__)
         for key in self.__dict__:
             if key.endswith('_') or (key == '_initialized'):
                 del state[key]
-        all_params = self.get_all_params()
-        state['_all_params'] = all_params
+        return state
+
+    def __getstate__(self):
+        state = self._get_state_without_params()
+        if getattr(self, '_initialized', None):
+            state['_all_params'] = self.get_all_params()
         return state
 
     def __setstate__(self, state):
-        all_params = state.pop('_all_params')
+        all_params = state.pop('_all_params', None)
         self.__dict__ = state
-        self.set_all_params(all_params)
-        self.initialize()
+        if all_params is not None:
+            self.set_all_params(all_params)
+            self.initialize()
 
 
 # pylint: disable=super-init-not-called,too-many-arguments
 # pylint: disable=too-many-instance-attributes
-class NeuralNetClassifier(NeuralNetBase):
+class NeuralNetClassifier(NeuralNetBase, ClassifierMixin):
     """TODO"""
+
     def __init__(
             self,
             layer,
@@ -445,6 +1345,9 @@ class NeuralNetClassifier(NeuralNetBase):
             session_kwargs=None,
             on_training_started=(handlers.PrintLayerInfo(),),
             on_epoch_finished=(handlers.PrintTrainProgress(),),
+            steps_per_run=1,
+            cache_data=False,
+            time_batches=False,
     ):
         self.layer = layer
         self.objective = objective
@@ -457,6 +1360,9 @@ class NeuralNetClassifier(NeuralNetBase):
         self.session_kwargs = session_kwargs
         self.on_training_started = on_training_started
         self.on_epoch_finished = on_epoch_finished
+        self.steps_per_run = steps_per_run
+        self.cache_data = cache_data
+        self.time_batches = time_batches
 
     def _initialize_output_layer(self, layer, output_shape):
         if isinstance(layer, DenseLayer):
@@ -473,16 +1379,34 @@ class NeuralNetClassifier(NeuralNetBase):
     def classes_(self):
         return self.encoder.classes_
 
-    def predict_proba(self, X):
-        """TODO"""
-        session = self.session_
-        y_proba = []
+    def predict_proba_iter(self, X):
+        """Yield class probabilities batch by batch.
 
-        for Xb, _ in self.batch_iterator_test_(X):
-            feed_dict = {self.Xs_: Xb, self.deterministic_: True}
-            y_proba.append(
-                session.run(self.feed_forward_, feed_dict=feed_dict))
-        return np.vstack(y_proba)
+        `X` may also be an iterable of batches, which allows to
+        predict on a stream of data with constant memory.
+
+        """
+        return self._iter_forward(X)
+
+    def predict_proba(self, X, out=None):
+        """Predict class probabilities.
+
+        If given, the probabilities are written into `out`, which can
+        be any array of the right shape (e.g. a memmap). Otherwise,
+        the output array is allocated once and filled batch by batch.
+
+        """
+        return self._forward(X, out=out)
+
+    def predict_iter(self, X):
+        """Yield class predictions batch by batch.
+
+        `X` may also be an iterable of batches, which allows to
+        predict on a stream of data with constant memory.
+
+        """
+        for y_proba in self.predict_proba_iter(X):
+            yield np.argmax(y_proba, axis=1)
 
     def predict(self, X):
         y_proba = self.predict_proba(X)
@@ -491,8 +1415,9 @@ class NeuralNetClassifier(NeuralNetBase):
 
 # pylint: disable=super-init-not-called,too-many-arguments
 # pylint: disable=too-many-instance-attributes
-class NeuralNetRegressor(NeuralNetBase):
+class NeuralNetRegressor(NeuralNetBase, RegressorMixin):
     """TODO"""
+
     def __init__(
             self,
             layer,
@@ -506,6 +1431,9 @@ class NeuralNetRegressor(NeuralNetBase):
             session_kwargs=None,
             on_training_started=(handlers.PrintLayerInfo(),),
             on_epoch_finished=(handlers.PrintTrainProgress(),),
+            steps_per_run=1,
+            cache_data=False,
+            time_batches=False,
     ):
         self.layer = layer
         self.objective = objective
@@ -518,6 +1446,9 @@ class NeuralNetRegressor(NeuralNetBase):
         self.session_kwargs = session_kwargs
         self.on_training_started = on_training_started
         self.on_epoch_finished = on_epoch_finished
+        self.steps_per_run = steps_per_run
+        self.cache_data = cache_data
+        self.time_batches = time_batches
 
     def _initialize_output_layer(self, layer, output_shape):
         if isinstance(layer, DenseLayer):
@@ -533,12 +1464,21 @@ class NeuralNetRegressor(NeuralNetBase):
         output_dim = list(y.shape[1:])
         return [None] + output_dim
 
-    def predict(self, X):
-        session = self.session_
-        y_pred = []
+    def predict_iter(self, X):
+        """Yield predictions batch by batch.
 
-        for Xb, _ in self.batch_iterator_test_(X):
-            feed_dict = {self.Xs_: Xb, self.deterministic_: True}
-            y_pred.append(
-                session.run(self.feed_forward_, feed_dict=feed_dict))
-        return np.vstack(y_pred)
+        `X` may also be an iterable of batches, which allows to
+        predict on a stream of data with constant memory.
+
+        """
+        return self._iter_forward(X)
+
+    def predict(self, X, out=None):
+        """Predict the targets.
+
+        If given, the predictions are written into `out`, which can be
+        any array of the right shape (e.g. a memmap). Otherwise, the
+        output array is allocated once and filled batch by batch.
+
+        """
+        return self._forward(X, out=out)
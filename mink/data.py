@@ -0,0 +1,118 @@
+"""Contains helpers to work with data that does not fit into memory."""
+
+import glob
+import os
+
+import numpy as np
+
+
+__all__ = ['ShardedArray', 'as_array']
+
+
+class ShardedArray:
+    """Read-only, array-like concatenation of `.npy` files along the
+    first axis.
+
+    The shards are memory-mapped, so that indexing only reads the
+    requested rows from disk. Supports `len`, `shape`, `dtype`, and
+    indexing the first axis with an int, a slice, or an array of
+    indices.
+
+    Parameters
+    ----------
+    paths : list of str
+        Paths to the `.npy` shards, in order. All shards must have
+        the same dtype and the same shape except for the first axis.
+
+    """
+    def __init__(self, paths):
+        self.paths = list(paths)
+        if not self.paths:
+            raise ValueError("ShardedArray needs at least one shard.")
+
+        shards = self._get_shards()
+        if len({(shard.shape[1:], shard.dtype) for shard in shards}) > 1:
+            raise ValueError("All shards must have the same dtype and "
+                             "the same shape except for the first axis.")
+
+        lengths = [shard.shape[0] for shard in shards]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.shape = (int(self.offsets[-1]),) + shards[0].shape[1:]
+        self.dtype = shards[0].dtype
+
+    @classmethod
+    def from_dir(cls, dirname):
+        """Use all `.npy` files in `dirname`, in sorted order."""
+        return cls(sorted(glob.glob(os.path.join(dirname, '*.npy'))))
+
+    def _get_shards(self):
+        shards = getattr(self, '_shards', None)
+        if shards is None:
+            shards = [np.load(path, mmap_mode='r') for path in self.paths]
+            self._shards = shards
+        return shards
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        shards = self._get_shards()
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+
+            parts = []
+            for shard, offset in zip(shards, self.offsets):
+                lo = max(start - offset, 0)
+                hi = min(stop - offset, shard.shape[0])
+                if lo < hi:
+                    parts.append(shard[lo:hi])
+            if not parts:
+                return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+            return np.concatenate(parts)
+
+        if np.isscalar(key):
+            if key < 0:
+                key += len(self)
+            i = np.searchsorted(self.offsets, key, side='right') - 1
+            return np.asarray(shards[i][key - self.offsets[i]])
+
+        indices = np.asarray(key)
+        out = np.empty(indices.shape + self.shape[1:], dtype=self.dtype)
+        shard_idx = np.searchsorted(self.offsets, indices, side='right') - 1
+        for i in np.unique(shard_idx):
+            mask = shard_idx == i
+            out[mask] = shards[i][indices[mask] - self.offsets[i]]
+        return out
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_shards', None)
+        return state
+
+    def __repr__(self):
+        return "ShardedArray(shape={}, dtype={}, num_shards={})".format(
+            self.shape, self.dtype, len(self.paths))
+
+
+def as_array(X):
+    """Turn a path into an array-like that is read lazily from disk.
+
+    A path to a `.npy` file is memory-mapped, a path to a directory
+    is turned into a `ShardedArray` of the `.npy` files it
+    contains. Anything else is returned unchanged.
+
+    """
+    if not isinstance(X, str):
+        return X
+    if os.path.isdir(X):
+        return ShardedArray.from_dir(X)
+    return np.load(X, mmap_mode='r')
@@ -4,10 +4,15 @@ classes.
 """
 
 from collections import OrderedDict
-import functools
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import glob
 import itertools
-import operator
+import os
+import pickle
+import re
 import sys
+import time
 
 import numpy as np
 from sklearn.base import BaseEstimator
@@ -17,9 +22,11 @@ from sklearn.metrics import mean_squared_error
 from sklearn.metrics import r2_score
 from sklearn.metrics.scorer import check_scoring
 from tabulate import tabulate
+from tensorflow.python.client import timeline
 
 from mink.utils import get_all_layers
 from mink.utils import get_layer_name
+from mink.utils import get_shape
 
 __all__ = [
     'make_classification_callbacks',
@@ -36,10 +43,29 @@ class ansi:
     ENDC = '\033[0m'
 
 
+class StopTraining(Exception):
+    """Raised by a handler to stop the training loop after the current
+    epoch.
+
+    """
+
+
 class Handler(BaseEstimator):
     def _clear(self):
         pass
 
+    def _resume(self, net):
+        """Restore the state of an earlier training run before `fit`
+        starts training. Returns the number of epochs that are done
+        already.
+
+        """
+        return 0
+
+    def _finish(self, net):
+        """Called when `fit` stops training."""
+        pass
+
     def __call__(self, net):
         raise NotImplementedError
 
@@ -69,6 +95,8 @@ class PrintTrainProgress(Handler):
 
     def _clear(self):
         self.first_iteration = True
+        self.columns_ = []
+        self.printed_ = {}
 
     def __call__(self, net):
         if not net.verbose:
@@ -77,23 +105,87 @@ class PrintTrainProgress(Handler):
         print(self.table(net.train_history_))
         sys.stdout.flush()
 
-    def table(self, history):
-        colors = itertools.cycle([
-            ansi.CYAN, ansi.GREEN, ansi.MAGENTA, ansi.RED])
-        info = history[-1]
+    def _finish(self, net):
+        # print the scores that were computed in the background and
+        # arrived after the last epoch
+        if not net.verbose or not net.train_history_:
+            return
 
-        for key in self.scores_to_minimize:
-            self.min_scores[key] = min(info[key], self.min_scores[key])
+        out = self.table(net.train_history_, updated_only=True)
+        if out:
+            print(out)
+            sys.stdout.flush()
+
+    def table(self, history, updated_only=False):
+        """Render the last epoch of `history`, preceded by the earlier
+        epochs that received scores since they were printed (e.g. from
+        scoring in the background).
+
+        The columns keep their order from one call to the next; a new
+        header is rendered whenever new columns show up. Missing
+        values are left empty.
+
+        """
+        # rows are tracked by their position in the history, since the
+        # epochs are numbered anew on every call to fit
+        printed = self.__dict__.setdefault('printed_', {})
+        columns = self.__dict__.setdefault('columns_', [])
+
+        def is_updated(i):
+            return len(history[i]) > printed.get(i, len(history[i]))
+
+        last = len(history) - 1
+        indices = [i for i in range(last) if is_updated(i)]
+        if (not updated_only) or is_updated(last):
+            indices.append(last)
+        if not indices:
+            return ""
+        rows = [history[i] for i in indices]
+
+        new_columns = False
+        for info in rows:
+            for key in self.scores_to_minimize:
+                if key in info:
+                    self.min_scores[key] = min(
+                        info[key], self.min_scores[key])
+
+            for key in self.scores_to_maximize:
+                if key in info:
+                    self.max_scores[key] = max(
+                        info[key], self.max_scores[key])
+
+            for key in info:
+                if (key not in ['epoch', 'dur']) and (key not in columns):
+                    columns.append(key)
+                    new_columns = True
+
+        table = [self._get_row(info, columns) for info in rows]
+        for i in indices:
+            printed[i] = len(history[i])
+
+        tabulated = tabulate(
+            table,
+            headers='keys',
+            tablefmt=self.tablefmt,
+            floatfmt=self.floatfmt,
+        )
 
-        for key in self.scores_to_maximize:
-            self.max_scores[key] = max(info[key], self.max_scores[key])
+        if self.first_iteration or new_columns:
+            self.first_iteration = False
+            return tabulated
+        return tabulated.split('\n', 2)[-1]
 
-        table = [("epoch", info['epoch'])]
+    def _get_row(self, info, columns):
+        colors = itertools.cycle([
+            ansi.CYAN, ansi.GREEN, ansi.MAGENTA, ansi.RED])
+        row = [("epoch", info['epoch'])]
 
-        for key, val in info.items():
-            if key in ['epoch', 'dur']:
+        for key in columns:
+            if key not in info:
+                row.append((key, ""))
                 continue
 
+            val = info[key]
             is_best = None
             if key in self.scores_to_minimize:
                 is_best = val == self.min_scores[key]
@@ -102,29 +194,14 @@ class PrintTrainProgress(Handler):
                 is_best = val == self.max_scores[key]
                 color = next(colors)
 
-            table.append((key, self.template.format(
+            row.append((key, self.template.format(
                 color if is_best else "",
-                info[key],
+                val,
                 ansi.ENDC if is_best else "",
             )))
 
-        table.append(("dur", int(info['dur'])))
-
-        tabulated = tabulate(
-            [OrderedDict(table)],
-            headers='keys',
-            tablefmt=self.tablefmt,
-            floatfmt=self.floatfmt,
-        )
-
-        out = ""
-        if self.first_iteration:
-            out = "\n".join(tabulated.split('\n', 2)[:2])
-            out += "\n"
-            self.first_iteration = False
-        out += tabulated.rsplit('\n', 1)[-1]
-
-        return out
+        row.append(("dur", int(info['dur'])))
+        return OrderedDict(row)
 
 
 class PrintLayerInfo(Handler):
@@ -149,15 +226,11 @@ class PrintLayerInfo(Handler):
     @staticmethod
     def get_greeting(net):
         """Information about the number of learnable parameters."""
-        all_params = net.get_all_params()
-        shapes = []
-        for params in all_params:
-            for param in params.values():
-                shapes.append(param.shape)
-
-        num_params = functools.reduce(
-            operator.add,
-            [functools.reduce(operator.mul, shape) for shape in shapes])
+        # use the static shapes, so that no weights have to be fetched
+        num_params = 0
+        for layer in get_all_layers(net.layer):
+            for param in getattr(layer, 'params_', {}).values():
+                num_params += int(np.prod(get_shape(param)))
 
         message = ("# Neural Network with {} learnable parameters"
                    "\n".format(num_params))
@@ -211,52 +284,152 @@ class ValidationScoreHandler(Handler):
         return state
 
 
-class ClassificationScoreHandler(Handler):
-    def __init__(self, X, y):
+class _ScoreHandler(Handler):
+    """Base class of the handlers that score the net on validation
+    data.
+
+    Parameters
+    ----------
+    X, y : array-like
+        The validation data.
+
+    background : bool (default=False)
+        If False, the net is scored right away, and training waits
+        for it. If True, the weights are snapshotted and scored in a
+        background thread with a second session on the same graph,
+        while training continues. The scores are added to the
+        `train_history_` entry of the epoch they belong to once they
+        are available, at the latest when `fit` returns.
+
+    every : int (default=1)
+        Score the net every that many epochs.
+
+    every_seconds : float or None (default=None)
+        If given, score the net at the end of the first epoch that
+        finishes at least that many seconds after the last scoring,
+        instead of every `every` epochs.
+
+    """
+    def __init__(self, X, y, background=False, every=1, every_seconds=None):
         self.X = X
         self.y = y
+        self.background = background
+        self.every = every
+        self.every_seconds = every_seconds
 
-    def __call__(self, net):
-        y_proba = net.predict_proba(self.X)
-        y_pred = np.argmax(y_proba, axis=1)
+    def _get_scores(self, y_out):
+        raise NotImplementedError
+
+    def _predict(self, net):
+        raise NotImplementedError
 
-        logloss = log_loss(self.y, y_proba)
-        accuracy = accuracy_score(self.y, y_pred)
+    def _clear(self):
+        self.last_time_ = None
 
-        net.train_history_[-1]['valid loss'] = logloss
-        net.train_history_[-1]['valid acc'] = accuracy
-        net.train_history_[-1]['train/valid'] = (
-            net.train_history_[-1]['train loss'] /
-            net.train_history_[-1]['valid loss'])
+    def _is_due(self, info):
+        if self.every_seconds is None:
+            return info['epoch'] % self.every == 0
 
-    def __repr__(self):
-        return "ClassificationScoreHandler({}, {})".format(
-            'valid loss',
-            'valid acc',
+        now = time.time()
+        last_time = getattr(self, 'last_time_', None)
+        if (last_time is not None) and (now - last_time < self.every_seconds):
+            return False
+        self.last_time_ = now
+        return True
+
+    def __call__(self, net):
+        self._attach_scores(wait=False)
+        info = net.train_history_[-1]
+        if not self._is_due(info):
+            return
+
+        if not self.background:
+            self._add_scores(info, self._get_scores(self._predict(net)))
+            return
+
+        variables = net._get_variables(trainable_only=True)
+        values = net._get_variable_values(variables)
+        # the graph must not be changed by the background thread
+        net._get_assign_ops(variables)
+        if getattr(self, 'executor_', None) is None:
+            self.executor_ = ThreadPoolExecutor(max_workers=1)
+            self.session_ = net._new_session()
+            # a copy of the fitted iterator, since it is used in
+            # another thread
+            self.batch_iterator_ = copy.deepcopy(net.batch_iterator_test_)
+            self.pending_ = []
+
+        future = self.executor_.submit(
+            self._score_snapshot, net, variables, values)
+        self.pending_.append((info, future))
+
+    def _score_snapshot(self, net, variables, values):
+        net._set_variable_values(variables, values, session=self.session_)
+        y_out = net._forward(
+            self.X,
+            session=self.session_,
+            batch_iterator=self.batch_iterator_,
         )
+        return self._get_scores(y_out)
+
+    def _attach_scores(self, wait):
+        """Add the scores that are done to the history, or wait for
+        all of them.
+
+        """
+        pending = getattr(self, 'pending_', [])
+        while pending and (wait or pending[0][1].done()):
+            info, future = pending.pop(0)
+            self._add_scores(info, future.result())
+
+    @staticmethod
+    def _add_scores(info, scores):
+        info.update(scores)
+        info['train/valid'] = info['train loss'] / info['valid loss']
+
+    def _finish(self, net):
+        self._attach_scores(wait=True)
+        executor = getattr(self, 'executor_', None)
+        if executor is not None:
+            executor.shutdown()
+            self.session_.close()
+            self.executor_ = self.session_ = self.batch_iterator_ = None
 
     def __getstate__(self):
         state = self.__dict__.copy()
         del state['X'], state['y']
+        for key in ['executor_', 'session_', 'batch_iterator_', 'pending_']:
+            state.pop(key, None)
         return state
 
 
-class RegressionScoreHandler(Handler):
-    def __init__(self, X, y):
-        self.X = X
-        self.y = y
+class ClassificationScoreHandler(_ScoreHandler):
+    def _predict(self, net):
+        return net.predict_proba(self.X)
 
-    def __call__(self, net):
-        y_pred = net.predict(self.X)
+    def _get_scores(self, y_proba):
+        y_pred = np.argmax(y_proba, axis=1)
+        return OrderedDict([
+            ('valid loss', log_loss(self.y, y_proba)),
+            ('valid acc', accuracy_score(self.y, y_pred)),
+        ])
 
-        mse = mean_squared_error(self.y, y_pred)
-        r2 = r2_score(self.y, y_pred)
+    def __repr__(self):
+        return "ClassificationScoreHandler({}, {})".format(
+            'valid loss',
+            'valid acc',
+        )
+
+
+class RegressionScoreHandler(_ScoreHandler):
+    def _predict(self, net):
+        return net.predict(self.X)
 
-        net.train_history_[-1]['valid loss'] = mse
-        net.train_history_[-1]['valid r2'] = r2
-        net.train_history_[-1]['train/valid'] = (
-            net.train_history_[-1]['train loss'] /
-            net.train_history_[-1]['valid loss'])
+    def _get_scores(self, y_pred):
+        return OrderedDict([
+            ('valid loss', mean_squared_error(self.y, y_pred)),
+            ('valid r2', r2_score(self.y, y_pred)),
+        ])
 
     def __repr__(self):
         return "ClassificationScoreHandler({}, {})".format(
@@ -264,14 +437,333 @@ class RegressionScoreHandler(Handler):
             'valid r2',
         )
 
+
+class Checkpoint(Handler):
+    """Periodically save the complete training state of the net.
+
+    The values of all variables (including the slots of the
+    optimizer), `train_history_`, the epoch, and the random states of
+    numpy and of the training iterator are snapshotted after every
+    `every` epochs. The snapshot is written to `dirname` in a
+    background thread, so that training does not wait for the disk.
+    Each file is written under a temporary name first, so that an
+    interrupted write never leaves a broken checkpoint behind.
+
+    Parameters
+    ----------
+    dirname : str
+        Directory the checkpoints are written to.
+
+    every : int (default=1)
+        Save a checkpoint every that many epochs.
+
+    keep : int or None (default=3)
+        Number of checkpoints that are kept; older ones are deleted.
+        If None, all checkpoints are kept.
+
+    resume : bool (default=True)
+        Whether `fit` on a net that has not been trained yet continues
+        from the latest checkpoint in `dirname`, if there is one. Only
+        the epochs missing from the checkpointed run are trained.
+
+    """
+    def __init__(self, dirname, every=1, keep=3, resume=True):
+        self.dirname = dirname
+        self.every = every
+        self.keep = keep
+        self.resume = resume
+
+    def __call__(self, net):
+        info = net.train_history_[-1]
+        if info['epoch'] % self.every:
+            return
+
+        variables = net._get_variables()
+        values = net._get_variable_values(variables)
+        iterator_rng = getattr(net.batch_iterator_train_, 'rng_', None)
+        state = {
+            'epoch': info['epoch'],
+            'variables': dict(zip(
+                [variable.name for variable in variables], values)),
+            'train_history': [OrderedDict(info)
+                              for info in net.train_history_],
+            'numpy_random_state': np.random.get_state(),
+            'iterator_random_state': (
+                iterator_rng.get_state() if iterator_rng else None),
+        }
+        # the history is counted in total, the epoch only per fit
+        filename = os.path.join(self.dirname, 'checkpoint-{:06d}.pkl'.format(
+            len(net.train_history_)))
+
+        # write one checkpoint at a time, in order
+        self._wait()
+        if getattr(self, 'executor_', None) is None:
+            self.executor_ = ThreadPoolExecutor(max_workers=1)
+        self.future_ = self.executor_.submit(self._write, filename, state)
+
+    def _write(self, filename, state):
+        os.makedirs(self.dirname, exist_ok=True)
+        with open(filename + '.tmp', 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + '.tmp', filename)
+
+        if self.keep:
+            for old_filename in self.get_checkpoints()[:-self.keep]:
+                os.remove(old_filename)
+
+    def _wait(self):
+        future = getattr(self, 'future_', None)
+        if future is not None:
+            self.future_ = None
+            # raises if the write failed
+            future.result()
+
+    def get_checkpoints(self):
+        """The paths of all checkpoints, from oldest to latest."""
+        return sorted(glob.glob(os.path.join(
+            self.dirname, 'checkpoint-*.pkl')))
+
+    def _resume(self, net):
+        checkpoints = self.get_checkpoints()
+        if (not self.resume) or net.train_history_ or (not checkpoints):
+            return 0
+
+        with open(checkpoints[-1], 'rb') as f:
+            state = pickle.load(f)
+
+        variables = net._get_variables()
+        missing = [variable.name for variable in variables
+                   if variable.name not in state['variables']]
+        if missing:
+            raise ValueError("The checkpoint {} does not match the net, "
+                             "it misses the variables {}.".format(
+                                 checkpoints[-1], ', '.join(missing)))
+        net._set_variable_values(
+            variables,
+            [state['variables'][variable.name] for variable in variables])
+
+        net.train_history_ = state['train_history']
+        np.random.set_state(state['numpy_random_state'])
+        if state['iterator_random_state'] is not None:
+            iterator_rng = np.random.RandomState()
+            iterator_rng.set_state(state['iterator_random_state'])
+            net.batch_iterator_train_.rng_ = iterator_rng
+        return state['epoch']
+
+    def _finish(self, net):
+        self._wait()
+        executor = getattr(self, 'executor_', None)
+        if executor is not None:
+            executor.shutdown()
+            self.executor_ = None
+
     def __getstate__(self):
         state = self.__dict__.copy()
-        del state['X'], state['y']
+        state.pop('executor_', None)
+        state.pop('future_', None)
+        return state
+
+
+class EarlyStopping(Handler):
+    """Stop training when a score in `train_history_` has not improved
+    for a number of epochs.
+
+    Whenever the score improves, the trainable variables are fetched
+    with a single session call and kept in memory, so that the weights
+    of the best epoch can be restored when training stops. Epochs
+    without the score are ignored. Scores that are computed in the
+    background are taken into account once they arrive; the weights
+    kept for them are those of the epoch in which they arrived.
+
+    Parameters
+    ----------
+    monitor : str (default='valid loss')
+        Key of the score in `train_history_`.
+
+    patience : int (default=5)
+        Number of epochs without improvement after which training is
+        stopped.
+
+    min_delta : float (default=0.0)
+        Minimum change of the score that counts as an improvement.
+
+    lower_is_better : bool (default=True)
+        Whether a lower score is better, as for losses.
+
+    restore_best_weights : bool (default=True)
+        Whether the weights of the best epoch are restored when
+        training stops.
+
+    """
+    def __init__(
+            self,
+            monitor='valid loss',
+            patience=5,
+            min_delta=0.0,
+            lower_is_better=True,
+            restore_best_weights=True,
+    ):
+        self.monitor = monitor
+        self.patience = patience
+        self.min_delta = min_delta
+        self.lower_is_better = lower_is_better
+        self.restore_best_weights = restore_best_weights
+
+    def _clear(self):
+        for key in ['best_score_', 'best_epoch_', 'best_weights_',
+                    'wait_', 'next_index_']:
+            self.__dict__.pop(key, None)
+
+    def _is_improvement(self, score):
+        best_score = getattr(self, 'best_score_', None)
+        if best_score is None:
+            return True
+        if self.lower_is_better:
+            return score < best_score - self.min_delta
+        return score > best_score + self.min_delta
+
+    def __call__(self, net):
+        # scores computed in the background are added to the epochs
+        # they belong to, which may lie a few epochs back; epochs are
+        # numbered anew on every call to fit, so the rows are tracked
+        # by their position in the history
+        history = net.train_history_
+        start = getattr(self, 'next_index_', 0)
+        for i in range(start, len(history)):
+            info = history[i]
+            if self.monitor not in info:
+                continue
+
+            self.next_index_ = i + 1
+            score = info[self.monitor]
+            if self._is_improvement(score):
+                self.best_score_ = score
+                self.best_epoch_ = info['epoch']
+                self.wait_ = 0
+                if self.restore_best_weights:
+                    variables = net._get_variables(trainable_only=True)
+                    self.best_weights_ = (
+                        variables, net._get_variable_values(variables))
+                continue
+
+            self.wait_ += 1
+            if self.wait_ >= self.patience:
+                self._restore(net)
+                raise StopTraining
+
+    def _resume(self, net):
+        # only the epochs trained by this call to fit count
+        self.next_index_ = len(getattr(net, 'train_history_', []))
+        return 0
+
+    def _restore(self, net):
+        best_weights = getattr(self, 'best_weights_', None)
+        if best_weights is not None:
+            net._set_variable_values(*best_weights)
+
+    def _finish(self, net):
+        self._restore(net)
+        self._clear()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('best_weights_', None)
         return state
 
 
-def make_classification_callbacks(X, y):
-    classification_scores = ClassificationScoreHandler(X, y)
+def _get_op_scope(node_name, layer_scopes=()):
+    """The top level scope of an op, where the gradient of an op counts
+    towards the op itself and suffixes that make names unique, like
+    in 'MatMul_3', are removed unless the scope belongs to a layer.
+
+    """
+    if node_name.startswith('gradients/'):
+        node_name = node_name[len('gradients/'):]
+    scope = node_name.split('/', 1)[0]
+    if scope in layer_scopes:
+        return scope
+    return re.sub(r'_\d+$', '', scope)
+
+
+class StepProfiler(Handler):
+    """Trace selected training steps and aggregate the time and memory
+    of their ops by scope, i.e. per layer for the ops of the layers.
+
+    The traced steps run with full trace options, all other steps run
+    as usual. For each traced step, a Chrome trace (to be opened at
+    chrome://tracing) can be written. The totals over all traced steps
+    are stored in `scope_stats_`, with the time in microseconds and the
+    allocated memory in bytes.
+
+    Parameters
+    ----------
+    steps : iterable of int (default=(10,))
+        The training steps to trace, counted from 0 since the net was
+        initialized. With `steps_per_run` > 1, a step is one session
+        call.
+
+    dirname : str or None (default=None)
+        If given, the Chrome trace of step `i` is written to
+        'timeline-{i}.json' in this directory.
+
+    """
+    def __init__(self, steps=(10,), dirname=None):
+        self.steps = steps
+        self.dirname = dirname
+
+    def _clear(self):
+        self.step_ = 0
+        self.traced_steps_ = []
+        self.scope_stats_ = OrderedDict()
+
+    def _start_step(self):
+        """Count a training step, return whether it should be traced."""
+        step = self.step_
+        self.step_ += 1
+        return step in self.steps
+
+    def _add_trace(self, run_metadata, layer_scopes=()):
+        step = self.step_ - 1
+        self.traced_steps_.append(step)
+
+        stats = self.scope_stats_
+        layer_scopes = set(layer_scopes)
+        for device_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in device_stats.node_stats:
+                scope = _get_op_scope(node_stats.node_name, layer_scopes)
+                if scope not in stats:
+                    stats[scope] = {'time': 0, 'memory': 0, 'ops': 0}
+                stats[scope]['time'] += node_stats.all_end_rel_micros
+                stats[scope]['memory'] += sum(
+                    memory.total_bytes for memory in node_stats.memory)
+                stats[scope]['ops'] += 1
+
+        if self.dirname is not None:
+            trace = timeline.Timeline(run_metadata.step_stats)
+            os.makedirs(self.dirname, exist_ok=True)
+            filename = os.path.join(
+                self.dirname, 'timeline-{}.json'.format(step))
+            with open(filename, 'w') as f:
+                f.write(trace.generate_chrome_trace_format(show_memory=True))
+
+    def __call__(self, net):
+        pass
+
+    def get_scope_table(self, tablefmt='pipe'):
+        """The aggregated stats of the scopes, most expensive first."""
+        rows = sorted(self.scope_stats_.items(),
+                      key=lambda item: -item[1]['time'])
+        table = OrderedDict([
+            ('scope', [scope for scope, _ in rows]),
+            ('time (us)', [stats['time'] for _, stats in rows]),
+            ('memory (B)', [stats['memory'] for _, stats in rows]),
+            ('ops', [stats['ops'] for _, stats in rows]),
+        ])
+        return tabulate(table, headers='keys', tablefmt=tablefmt)
+
+
+def make_classification_callbacks(X, y, **kwargs):
+    classification_scores = ClassificationScoreHandler(X, y, **kwargs)
     print_handler = PrintTrainProgress(
         scores_to_minimize=['valid loss'],
         scores_to_maximize=['valid acc']
@@ -280,8 +772,8 @@ def make_classification_callbacks(X, y):
     return callbacks
 
 
-def make_regression_callbacks(X, y):
-    regression_scores = RegressionScoreHandler(X, y)
+def make_regression_callbacks(X, y, **kwargs):
+    regression_scores = RegressionScoreHandler(X, y, **kwargs)
     print_handler = PrintTrainProgress(
         scores_to_minimize=['valid loss'],
         scores_to_maximize=['valid r2']
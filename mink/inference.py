@@ -0,0 +1,80 @@
+"""Contains a lean predictor for graphs written by
+`NeuralNetBase.export_inference`.
+
+"""
+
+import numpy as np
+import tensorflow as tf
+
+
+__all__ = ['InferenceNet']
+
+
+class InferenceNet:
+    """Make predictions with a frozen graph.
+
+    Only the forward pass is loaded, so that starting up is fast and
+    each prediction is a single call to the session.
+
+    Parameters
+    ----------
+    path : str
+        Path to a graph written by `export_inference`.
+
+    batch_size : int or None (default=None)
+        If given, predict at most that many samples per call to the
+        session, e.g. to limit memory usage. By default, all samples
+        are predicted at once.
+
+    session_kwargs : dict or None (default=None)
+        Keyword arguments for the tensorflow session.
+
+    """
+    def __init__(self, path, batch_size=None, session_kwargs=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.session_kwargs = session_kwargs
+
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.graph_ = graph
+        self.Xs_ = graph.get_tensor_by_name('mink_input:0')
+        self.feed_forward_ = graph.get_tensor_by_name('mink_output:0')
+        names = {node.name for node in graph_def.node}
+        if 'mink_predict' in names:
+            self.predict_ = graph.get_tensor_by_name('mink_predict:0')
+        else:
+            self.predict_ = self.feed_forward_
+        self.session_ = tf.Session(graph=graph, **(session_kwargs or {}))
+
+    def _run(self, output, X):
+        if self.batch_size is None:
+            return self.session_.run(output, feed_dict={self.Xs_: X})
+
+        return np.concatenate([
+            self.session_.run(
+                output, feed_dict={self.Xs_: X[i:i + self.batch_size]})
+            for i in range(0, len(X), self.batch_size)])
+
+    def predict_proba(self, X):
+        """The output of the net, i.e. the class probabilities for
+        classifiers.
+
+        """
+        return self._run(self.feed_forward_, X)
+
+    def predict(self, X):
+        """The class indices for classifiers, the output of the net
+        for regressors.
+
+        """
+        return self._run(self.predict_, X)
+
+    def close(self):
+        """Close the session."""
+        self.session_.close()
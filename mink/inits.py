@@ -16,7 +16,8 @@ __all__ = [
 
 
 class Init(BaseEstimator):
-    def __call__(self, shape):
+    def __call__(self, shape, name=None):
+        """Return a new variable of the given shape, named `name`."""
         raise NotImplementedError
 
 
@@ -28,8 +29,8 @@ class Constant(Init):
     ):
         self.value = value
 
-    def __call__(self, shape):
-        return tf.Variable(self.value * tf.ones(shape=shape))
+    def __call__(self, shape, name=None):
+        return tf.Variable(self.value * tf.ones(shape=shape), name=name)
 
 
 class Uniform(Init):
@@ -46,7 +47,7 @@ class Uniform(Init):
         self.mean = mean
         self.seed = seed
 
-    def __call__(self, shape):
+    def __call__(self, shape, name=None):
         range, std, mean = self.range, self.std, self.mean
         if std is not None:
             high = mean - np.sqrt(3) * std
@@ -62,7 +63,7 @@ class Uniform(Init):
             minval=low,
             maxval=high,
             seed=self.seed,
-        ))
+        ), name=name)
 
 
 class Normal(Init):
@@ -77,13 +78,13 @@ class Normal(Init):
         self.mean = mean
         self.seed = seed
 
-    def __call__(self, shape):
+    def __call__(self, shape, name=None):
         return tf.Variable(tf.random_normal(
             shape=shape,
             stddev=self.std,
             mean=self.mean,
             seed=self.seed,
-        ))
+        ), name=name)
 
 
 class TruncatedNormal(Init):
@@ -96,19 +97,19 @@ class TruncatedNormal(Init):
         self.mean = mean
         self.stddev = stddev
 
-    def __call__(self, shape):
+    def __call__(self, shape, name=None):
         return tf.Variable(tf.truncated_normal(
             shape=shape,
             mean=self.mean,
             stddev=self.stddev,
-        ))
+        ), name=name)
 
 
 class Zeros(Init):
-    def __call__(self, shape):
+    def __call__(self, shape, name=None):
         return tf.Variable(tf.zeros(
             shape=shape,
-        ))
+        ), name=name)
 
 
 class Glorot(Init):
@@ -123,7 +124,7 @@ class Glorot(Init):
         self.gain = gain
         self.c01b = c01b
 
-    def __call__(self, shape):
+    def __call__(self, shape, name=None):
         if self.c01b:
             if len(shape) != 4:
                 raise RuntimeError(
@@ -140,7 +141,7 @@ class Glorot(Init):
             receptive_field_size = np.prod(shape[2:])
 
         std = self.gain * np.sqrt(2.0 / ((n1 + n2) * receptive_field_size))
-        return self.initializer(std=std)(shape)
+        return self.initializer(std=std)(shape, name=name)
 
 
 class GlorotNormal(Glorot):
@@ -3,11 +3,22 @@ iterators.
 
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import mmap
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+
 import numpy as np
 from sklearn.base import BaseEstimator
 from sklearn.base import TransformerMixin
 from sklearn.utils import tosequence
 
+from mink.data import ShardedArray
+
 
 class IteratorPipeline(BaseEstimator, TransformerMixin):
     """A pipeline that is responsible for batching and, optionally,
@@ -16,16 +27,99 @@ class IteratorPipeline(BaseEstimator, TransformerMixin):
 
     Should be used with the iterator protocol.
 
+    Inputs may be numpy arrays, memory-mapped arrays, or
+    `mink.data.ShardedArray`s; in the latter cases, only the rows of
+    the current batch (and of the prefetched batches) are read from
+    disk.
+
+    Parameters
+    ----------
+    batch_size : int (default=128)
+        Number of samples per batch.
+
+    steps : list of (str, Iterator) tuples (default=[])
+        Transforms that are applied to each batch, in order.
+
+    deterministic : bool (default=False)
+        Whether the transforms are applied in deterministic mode.
+
+    prefetch : int (default=0)
+        Number of batches that are prepared in the background while
+        the current batch is being consumed. If 0, batches are
+        prepared lazily in the calling thread.
+
+    n_workers : int (default=1)
+        Number of producer threads or processes used when `prefetch`
+        is set. Batches are always returned in order.
+
+    backend : str (default='thread')
+        Either 'thread' or 'process'. With 'process', the transforms
+        are run in a pool of `n_workers` processes, so that
+        Python-level transforms are not limited by the GIL. The
+        workers are started (with the 'spawn' method, which is safe
+        next to tensorflow sessions) on the first pass after `fit` and
+        reused until the next `fit`, `set_params`, or `close`. Inputs
+        are written once to memory-mapped `.npy` files (in /dev/shm if
+        available) and transformed batches are returned the same way,
+        instead of being pickled. The transform steps are sent to the
+        workers once, so they have to be picklable, e.g. module-level
+        functions instead of lambdas in `FunctionIterator`. Note that
+        the workers use a copy of the pipeline, so state changed by
+        the transforms (e.g. counters) is not propagated back from
+        them.
+
+    shuffle : bool (default=False)
+        Whether to iterate over the samples in a new random order on
+        each pass. Batches are gathered through a permutation index
+        into preallocated buffers that are reused, so the data is
+        never copied as a whole. A batch thus stays unchanged while
+        the next batch is used, but is overwritten once the batch
+        after that has been requested; copy it to keep it longer.
+        Shuffling is meant for training, not for predicting.
+
+    random_state : int or None (default=None)
+        Seed of the random number generator used for shuffling.
+
+    last_batch : str (default='keep')
+        What to do with a last batch that is smaller than
+        `batch_size`: 'keep' it, 'pad' it with zeros to `batch_size`,
+        or 'drop' it. With 'pad' and 'drop', all batches have the same
+        shape. `batch_lengths` tells how many rows of each batch are
+        not padding. Dropping is meant for training, not for
+        predicting.
+
     """
     def __init__(
             self,
             batch_size=128,
             steps=[],
             deterministic=False,
+            prefetch=0,
+            n_workers=1,
+            backend='thread',
+            shuffle=False,
+            random_state=None,
+            last_batch='keep',
     ):
         self.batch_size = batch_size
         self.steps = steps
         self.deterministic = deterministic
+        self.prefetch = prefetch
+        self.n_workers = n_workers
+        self.backend = backend
+        self.shuffle = shuffle
+        self.random_state = random_state
+        self.last_batch = last_batch
+
+        allowed = ('thread', 'process')
+        if backend not in allowed:
+            raise ValueError("`backend` must be one of {}.".format(
+                ', '.join(allowed)))
+
+        allowed = ('keep', 'pad', 'drop')
+        if last_batch not in allowed:
+            raise ValueError("`last_batch` must be one of {}.".format(
+                ', '.join(allowed)))
 
         if steps:
             self._check_steps(steps)
@@ -63,8 +157,17 @@ class IteratorPipeline(BaseEstimator, TransformerMixin):
     def named_steps(self):
         return dict(self.steps)
 
+    def set_params(self, **params):
+        # worker processes would keep using the old parameters
+        self.close()
+        return super().set_params(**params)
+
     def fit(self, X, y, **kwargs):
         """TODO"""
+        self.close()
+        # start over from `random_state`, so that refits are
+        # reproducible
+        self.rng_ = None
         transform_steps = dict((step, {}) for step, __ in self.steps)
         for pname, pval in kwargs.items():
             step, param = pname.split('__', 1)
@@ -85,31 +188,46 @@ class IteratorPipeline(BaseEstimator, TransformerMixin):
                 **kwargs)
         return Xt, yt
 
-    def iter_transform(self, X, y=None, **kwargs):
+    def iter_transform(self, X, y=None, out=None, **kwargs):
         """Batch all X (and y) and apply transforms.
 
         This could be useful if you want to inspect the transformed
         data.
 
+        By default, the transformed batches are concatenated in
+        memory. For data that does not fit into memory, pass
+        preallocated arrays with as many rows as X as `out`, e.g.
+        created with `np.lib.format.open_memmap`; each batch is
+        written into them as soon as it is transformed. To process
+        the batches one by one instead, iterate over the pipeline.
+
+        Parameters
+        ----------
+        out : tuple of (array, array or None) or None (default=None)
+            Arrays that the transformed X and y are written to, and
+            that are returned.
+
         """
         batch_size = self.batch_size
-        Xt = []
-        if y is not None:
-            yt = []
-        else:
-            yt = y
-
+        Xt, yt = [], []
         for i in range((X.shape[0] + batch_size - 1) // batch_size):
-            Xb = X[i * batch_size:(i + 1) * batch_size]
+            sl = slice(i * batch_size, (i + 1) * batch_size)
+            yb = y[sl] if y is not None else None
+
+            Xbt, ybt = self.transform(X[sl], yb, **kwargs)
+            if out is None:
+                Xt.append(Xbt)
+                yt.append(ybt)
+                continue
+
+            out[0][sl] = Xbt
             if y is not None:
-                yb = y[i * batch_size:(i + 1) * batch_size]
-            else:
-                yb = None
+                out[1][sl] = ybt
 
-            Xbt, ybt = self.transform(Xb, yb, **kwargs)
-            Xt.append(Xbt)
-            yt.append(ybt)
-        return np.concatenate(Xt), np.concatenate(yt)
+        if out is not None:
+            return out
+        return np.concatenate(Xt), (
+            np.concatenate(yt) if y is not None else None)
 
     def fit_transform(self, X, y, **kwargs):
         """TODO"""
@@ -133,24 +251,360 @@ class IteratorPipeline(BaseEstimator, TransformerMixin):
         self.shape_ = shapes[0]
         return self
 
+    def batch_lengths(self):
+        """Return the number of rows of each batch of the current
+        inputs that are not padding.
+
+        """
+        shape, batch_size = self.shape_, self.batch_size
+        lengths = [batch_size] * (shape // batch_size)
+        if (shape % batch_size) and (self.last_batch != 'drop'):
+            lengths.append(shape % batch_size)
+        return lengths
+
+    def _get_batch(self, i):
+        batch_size = self.batch_size
+        sl = slice(i * batch_size, (i + 1) * batch_size)
+        pad = self.last_batch == 'pad'
+        if not self.shuffle:
+            batches = [input[sl] for input in self.inputs_]
+            if pad and (len(batches[0]) < batch_size):
+                batches = [_pad(batch, batch_size) for batch in batches]
+            return self.transform(*batches)
+
+        return self._gather_batch(
+            self.indices_[sl], self.buffers_[i % len(self.buffers_)])
+
+    def _gather_batch(self, indices, buffers):
+        """Gather the rows at `indices` into `buffers` and transform
+        them.
+
+        """
+        batches = [
+            _take(input, indices, out=buf[:len(indices)])
+            for input, buf in zip(self.inputs_, buffers)
+        ]
+        if (self.last_batch == 'pad') and (len(indices) < self.batch_size):
+            for buf in buffers:
+                buf[len(indices):] = 0
+            batches = buffers
+        return self.transform(*batches)
+
+    def _init_shuffle(self, num_buffers):
+        """Draw the permutation for the next pass and make sure that
+        there are enough batch buffers.
+
+        """
+        self.indices_ = self._draw_permutation(self.shape_)
+        self._init_buffers(num_buffers)
+
+    def _draw_permutation(self, num_samples):
+        if getattr(self, 'rng_', None) is None:
+            self.rng_ = np.random.RandomState(self.random_state)
+        return self.rng_.permutation(num_samples)
+
+    def _init_buffers(self, num_buffers):
+        shapes = [((self.batch_size,) + input.shape[1:], input.dtype)
+                  for input in self.inputs_]
+        buffers = getattr(self, 'buffers_', [])
+        if buffers and (
+                [(buf.shape, buf.dtype) for buf in buffers[0]] == shapes):
+            buffers = buffers[:num_buffers]
+        else:
+            buffers = []
+
+        while len(buffers) < num_buffers:
+            buffers.append([np.empty(shape, dtype=dtype)
+                            for shape, dtype in shapes])
+        self.buffers_ = buffers
+
+    def _iter_prefetch(self, submit, n_batches, n_ahead):
+        """Keep up to `n_ahead` batches in flight and yield them in
+        order.
+
+        """
+        futures = deque()
+        next_batch = 0
+        try:
+            while next_batch < min(n_ahead, n_batches):
+                futures.append(submit(next_batch))
+                next_batch += 1
+
+            while futures:
+                batch = futures.popleft().result()
+                if next_batch < n_batches:
+                    futures.append(submit(next_batch))
+                    next_batch += 1
+                yield batch
+        finally:
+            # don't prepare batches that will never be consumed,
+            # e.g. when training is interrupted
+            for future in futures:
+                future.cancel()
+
     def __iter__(self):
-        inputs = self.inputs_
-        shape = self.shape_
+        n_batches = len(self.batch_lengths())
+
+        if self.shuffle:
+            # one buffer per batch in flight plus the current and the
+            # previous batch
+            num_buffers = 1 if self.backend == 'process' else (
+                self.prefetch + 2)
+            self._init_shuffle(num_buffers)
+
+        if self.backend == 'process':
+            yield from self._iter_processes(n_batches)
+            return
+
+        if not self.prefetch:
+            for i in range(n_batches):
+                yield self._get_batch(i)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=self.n_workers)
+        try:
+            yield from self._iter_prefetch(
+                lambda i: executor.submit(self._get_batch, i),
+                n_batches,
+                n_ahead=self.prefetch,
+            )
+        finally:
+            executor.shutdown(wait=False)
+
+    def _get_process_pool(self):
+        """Return the pool of worker processes and the specs of the
+        shared inputs, starting the pool and sharing the inputs only
+        if necessary.
+
+        """
+        if getattr(self, 'pool_', None) is None:
+            try:
+                pickle.dumps(self.steps)
+            except (pickle.PicklingError, AttributeError, TypeError) as exc:
+                raise TypeError(
+                    "backend='process' requires transform steps that can "
+                    "be pickled, e.g. FunctionIterators with module-level "
+                    "functions instead of lambdas: {}".format(exc))
+            self.shared_dir_ = _make_shared_dir()
+            # forked workers would inherit the threads of tensorflow
+            # in an unusable state
+            context = multiprocessing.get_context('spawn')
+            self.pool_ = context.Pool(
+                self.n_workers,
+                initializer=_init_process_worker,
+                initargs=(self, self.shared_dir_),
+            )
+            self.shared_inputs_, self.shared_specs_ = (), ()
+
+        if not _are_same(self.shared_inputs_, self.inputs_):
+            _remove_shared(self.shared_specs_)
+            self.shared_specs_ = tuple(
+                _share_input(input, self.shared_dir_)
+                for input in self.inputs_)
+            self.shared_inputs_ = self.inputs_
+        return self.pool_, self.shared_specs_
+
+    def _iter_processes(self, n_batches):
+        pool, specs = self._get_process_pool()
+        indices = self.indices_ if self.shuffle else None
         batch_size = self.batch_size
 
-        for i in range((shape + batch_size - 1) // batch_size):
-            sl = slice(i * batch_size, (i + 1) * batch_size)
-            batches = [input[sl] for input in inputs]
-            yield self.transform(*batches)
+        def submit(i):
+            batch_indices = None
+            if indices is not None:
+                batch_indices = indices[i * batch_size:(i + 1) * batch_size]
+            return _PoolFuture(pool.apply_async(
+                _process_batch, (specs, i, batch_indices)))
+
+        yield from self._iter_prefetch(
+            submit,
+            n_batches,
+            n_ahead=max(self.prefetch, self.n_workers),
+        )
+
+    def close(self):
+        """Stop the worker processes of the 'process' backend and
+        delete the data shared with them.
+
+        """
+        pool = self.__dict__.pop('pool_', None)
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        shared_dir = self.__dict__.pop('shared_dir_', None)
+        if shared_dir is not None:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+        self.__dict__.pop('shared_inputs_', None)
+        self.__dict__.pop('shared_specs_', None)
+
+    def __del__(self):
+        self.close()
 
     def __getstate__(self):
         state = dict(self.__dict__)
-        for attr in state:
+        for attr in self.__dict__:
             if attr.endswith('_'):
                 del state[attr]
         return state
 
 
+class _PoolFuture:
+    """Wrap the result of a batch computed by a worker process in the
+    future interface used by `_iter_prefetch`.
+
+    """
+    def __init__(self, async_result):
+        self.async_result = async_result
+
+    def result(self):
+        return tuple(_from_file(filename)
+                     for filename in self.async_result.get())
+
+    def cancel(self):
+        # tasks of a pool cannot be cancelled, so wait for the batch
+        # and delete it
+        try:
+            filenames = self.async_result.get()
+        except Exception:  # pylint: disable=broad-except
+            return
+        for filename in filenames:
+            if filename is not None:
+                os.remove(filename)
+
+
+def _pad(batch, batch_size):
+    """Pad a batch with zeros to `batch_size` rows."""
+    padding = np.zeros(
+        (batch_size - len(batch),) + batch.shape[1:], dtype=batch.dtype)
+    return np.concatenate([batch, padding])
+
+
+def _take(input, indices, out):
+    """Gather rows of `input` into `out`."""
+    if isinstance(input, np.ndarray):
+        return np.take(input, indices, axis=0, out=out)
+    out[...] = input[indices]
+    return out
+
+
+def _make_shared_dir():
+    """Create a temporary directory for the data exchanged with worker
+    processes, in memory if possible.
+
+    """
+    # /dev/shm is backed by memory on Linux
+    dirname = '/dev/shm'
+    if not (os.path.isdir(dirname) and os.access(dirname, os.W_OK)):
+        dirname = None
+    return tempfile.mkdtemp(prefix='mink-', dir=dirname)
+
+
+def _are_same(inputs, other_inputs):
+    return (len(inputs) == len(other_inputs)) and all(
+        a is b for a, b in zip(inputs, other_inputs))
+
+
+def _share_input(input, dirname):
+    """Make an input available to worker processes.
+
+    Inputs that are backed by files are reopened by the workers, all
+    others are written to a new file in `dirname`.
+
+    """
+    if isinstance(input, ShardedArray):
+        return ('sharded', input)
+
+    if isinstance(input, np.memmap) and (input.filename is not None) and (
+            input.flags.c_contiguous):
+        # the memmap may be a view, so determine the offset of its
+        # data relative to the start of the file
+        mapped = input._mmap  # pylint: disable=protected-access
+        map_start = np.frombuffer(mapped, dtype=np.uint8).ctypes.data
+        offset = (input.offset - input.offset % mmap.ALLOCATIONGRANULARITY +
+                  input.ctypes.data - map_start)
+        return ('memmap', input.filename, input.dtype.str,
+                input.shape, offset)
+
+    return ('shared', _to_file(np.asarray(input), dirname))
+
+
+def _attach_input(spec):
+    kind, args = spec[0], spec[1:]
+    if kind == 'sharded':
+        return args[0]
+    if kind == 'memmap':
+        filename, dtype, shape, offset = args
+        return np.memmap(
+            filename, dtype=dtype, mode='r', shape=shape, offset=offset)
+    return np.load(args[0], mmap_mode='r')
+
+
+def _remove_shared(specs):
+    """Delete the files of inputs that were shared by `_share_input`."""
+    for spec in specs:
+        if spec[0] == 'shared':
+            os.remove(spec[1])
+
+
+def _to_file(arr, dirname):
+    """Write an array to a new `.npy` file in `dirname` and return its
+    path.
+
+    """
+    fd, filename = tempfile.mkstemp(suffix='.npy', dir=dirname)
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, arr)
+    return filename
+
+
+def _from_file(filename):
+    """Memory-map an array written by `_to_file` and delete the file.
+
+    The mapping stays valid after the file is deleted, and writing to
+    the array does not change the file (copy-on-write), so the data
+    is not copied unless it is modified.
+
+    """
+    if filename is None:
+        return None
+
+    arr = np.load(filename, mmap_mode='c')
+    os.remove(filename)
+    return arr
+
+
+# state of an IteratorPipeline worker process
+_worker_state = {}
+
+
+def _init_process_worker(pipeline, dirname):
+    _worker_state.update({
+        'pipeline': pipeline,
+        'dirname': dirname,
+        'specs': None,
+    })
+
+
+def _process_batch(specs, i, indices):
+    pipeline = _worker_state['pipeline']
+    if specs != _worker_state['specs']:
+        # the inputs were changed since the last batch
+        pipeline.inputs_ = tuple(_attach_input(spec) for spec in specs)
+        _worker_state['specs'] = specs
+
+    if indices is None:
+        outputs = pipeline._get_batch(i)
+    else:
+        # batches are written to files right away, so a single
+        # buffer suffices
+        pipeline._init_buffers(1)
+        outputs = pipeline._gather_batch(indices, pipeline.buffers_[0])
+
+    return [None if output is None else
+            _to_file(output, _worker_state['dirname'])
+            for output in outputs]
+
+
 def _identity(X):
     return X
 
@@ -4,8 +4,10 @@ from sklearn.base import BaseEstimator
 from sklearn.base import TransformerMixin
 import tensorflow as tf
 
+from mink.inits import Init
 from mink.utils import get_layer_name
 from mink.utils import get_shape
+from mink.utils import layer_scope
 from mink.utils import set_named_layer_param
 
 
@@ -31,7 +33,8 @@ class Layer(BaseEstimator, TransformerMixin):
         if len(Xs_incs) == 1:
             Xs_incs = Xs_incs[0]
 
-        self.fit(Xs_incs, ys, **kwargs)
+        with layer_scope(self):
+            self.fit(Xs_incs, ys, **kwargs)
         return self
 
     def fit(self, Xs_inc, ys=None, **kwargs):
@@ -48,7 +51,8 @@ class Layer(BaseEstimator, TransformerMixin):
         if len(Xs_incs) == 1:
             Xs_incs = Xs_incs[0]
 
-        X_out = self.transform(Xs_incs, **kwargs)
+        with layer_scope(self):
+            X_out = self.transform(Xs_incs, **kwargs)
         self.output_shape = get_shape(X_out)
 
         # handle tensorflow logging
@@ -83,11 +87,15 @@ class Layer(BaseEstimator, TransformerMixin):
             param = spec
         elif shape is None:
             raise TypeError('Cannot add this parameter without a shape.')
+        elif type(spec).__call__.__module__ == Init.__module__:
+            # name the variable after the parameter, e.g. 'dense/W';
+            # inits of users may not accept a name
+            param = spec(shape, name=name.rstrip('_'))
         else:
             param = spec(shape)
 
         if not isinstance(param, (tf.Variable, tf.Tensor)):
-            param = tf.Variable(param)
+            param = tf.Variable(param, name=name.rstrip('_'))
 
         if force or (name not in self.params_):
             self.params_[name] = param
@@ -140,6 +148,12 @@ class Layer(BaseEstimator, TransformerMixin):
                 setattr(self, key, value)
         return self
 
+    def _clear(self):
+        """Remove everything the layer learned when it was built."""
+        for key in list(self.__dict__):
+            if key.endswith('_') or (key == '_transform'):
+                del self.__dict__[key]
+
     def __getstate__(self):
         state = dict(self.__dict__)
         for key in self.__dict__:
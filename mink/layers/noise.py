@@ -1,5 +1,7 @@
 import tensorflow as tf
 
+from mink.utils import add_hyperparam
+
 from .base import Layer
 
 
@@ -25,7 +27,14 @@ class DropoutLayer(Layer):
             'deterministic',
             tf.Variable(False))
 
-        keep_prob = 1.0 - self.p
+        # `p` can be changed with `set_params` after initialization
+        keep_prob = 1.0 - add_hyperparam(self, 'p')
+        if isinstance(deterministic, bool):
+            # known while building the graph, no need for a branch
+            if deterministic:
+                return Xs_inc
+            return tf.nn.dropout(Xs_inc, keep_prob=keep_prob)
+
         return tf.cond(
             deterministic,
             lambda: Xs_inc,
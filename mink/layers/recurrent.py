@@ -45,13 +45,22 @@ class RecurrentLayer(Layer):
         return self
 
     def transform(self, Xs_inc, **kwargs):
-        return tf.nn.dynamic_rnn(
+        variables = set(tf.trainable_variables())
+        output = tf.nn.dynamic_rnn(
             inputs=Xs_inc,
             cell=self.cell_,
             dtype=tf.float32,
             sequence_length=self.sequence_length,
         )[0]
 
+        # the cell creates its variables itself, remember them so
+        # that they can be exported
+        if not getattr(self, 'cell_variables_', None):
+            self.cell_variables_ = [
+                variable for variable in tf.trainable_variables()
+                if variable not in variables]
+        return output
+
 
 class LSTMLayer(RecurrentLayer):
     def __init__(
@@ -0,0 +1,359 @@
+"""Contains an inference engine for trained mink nets that only needs
+numpy.
+
+Use `export_numpy` (which requires tensorflow) to write the
+architecture and the weights of a trained net to a `.npz` file, then
+load it with `NumpyNet`, e.g. in a process that does not have
+tensorflow installed.
+
+"""
+
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+__all__ = ['export_numpy', 'NumpyNet']
+
+
+def _sigmoid(X):
+    # numerically stable version of 1 / (1 + exp(-X))
+    return np.exp(-np.logaddexp(0, -X)).astype(X.dtype)
+
+
+def _softmax(X):
+    exp = np.exp(X - X.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+# names of mink nonlinearities and tensorflow activation functions
+_NONLINEARITIES = {
+    'Linear': lambda X: X,
+    'Rectify': lambda X: np.maximum(X, 0),
+    'Sigmoid': _sigmoid,
+    'Softmax': _softmax,
+    'Tanh': np.tanh,
+    'relu': lambda X: np.maximum(X, 0),
+    'sigmoid': _sigmoid,
+    'tanh': np.tanh,
+}
+
+
+def _get_nonlinearity_name(func):
+    from mink.nonlinearities import Nonlinearity
+
+    if isinstance(func, Nonlinearity):
+        name = func.__class__.__name__
+    else:
+        name = getattr(func, '__name__', None)
+    if name not in _NONLINEARITIES:
+        raise ValueError("The nonlinearity {} is not supported by the "
+                         "numpy backend.".format(func))
+    return name
+
+
+def _get_variable(variables, suffix):
+    for variable in variables:
+        if variable.name.endswith(suffix + ':0'):
+            return variable
+    return None
+
+
+def _get_cell_spec(layer):
+    """The spec of a recurrent layer, and its cell variables by role."""
+    import tensorflow as tf
+
+    rnn_cell = tf.nn.rnn_cell
+    cell = layer.cell_
+    variables = getattr(layer, 'cell_variables_', [])
+    spec = {
+        'num_units': cell.output_size,
+        'nonlinearity': _get_nonlinearity_name(cell._activation),
+    }
+
+    if isinstance(cell, rnn_cell.BasicRNNCell):
+        spec['type'] = 'rnn'
+        roles = {'W': 'Linear/Matrix', 'b': 'Linear/Bias'}
+    elif isinstance(cell, rnn_cell.LSTMCell):
+        if cell._num_proj is not None:
+            raise ValueError("LSTM cells with projections are not "
+                             "supported by the numpy backend.")
+        spec['type'] = 'lstm'
+        spec['forget_bias'] = cell._forget_bias
+        spec['cell_clip'] = cell._cell_clip
+        roles = {'W': 'W_0', 'b': 'B'}
+        if cell._use_peepholes:
+            roles.update({'w_f': 'W_F_diag', 'w_i': 'W_I_diag',
+                          'w_o': 'W_O_diag'})
+    elif isinstance(cell, rnn_cell.GRUCell):
+        spec['type'] = 'gru'
+        roles = {
+            'W_gates': 'Gates/Linear/Matrix',
+            'b_gates': 'Gates/Linear/Bias',
+            'W_candidate': 'Candidate/Linear/Matrix',
+            'b_candidate': 'Candidate/Linear/Bias',
+        }
+    else:
+        raise ValueError("The cell {} is not supported by the numpy "
+                         "backend.".format(cell))
+
+    cell_variables = {}
+    for role, suffix in roles.items():
+        variable = _get_variable(variables, suffix)
+        if variable is None:
+            raise ValueError("Could not find the variable {} of layer "
+                             "{}.".format(suffix, layer))
+        cell_variables[role] = variable
+    return spec, cell_variables
+
+
+def _get_layer_spec(layer):
+    """The spec of a layer, and the variables it needs by role."""
+    from mink import layers
+
+    if isinstance(layer, layers.InputLayer):
+        return {'type': 'input'}, {}
+    if isinstance(layer, layers.DenseLayer):
+        spec = {
+            'type': 'dense',
+            'nonlinearity': _get_nonlinearity_name(layer.nonlinearity_),
+        }
+        return spec, {'W': layer.W_, 'b': layer.b_}
+    if isinstance(layer, layers.Conv2DLayer):
+        spec = {
+            'type': 'conv2d',
+            'strides': list(layer.strides_[1:3]),
+            'padding': layer.padding,
+            'nonlinearity': _get_nonlinearity_name(layer.nonlinearity),
+        }
+        return spec, {'W': layer.W_, 'b': layer.b_}
+    if isinstance(layer, layers.MaxPool2DLayer):
+        spec = {
+            'type': 'maxpool2d',
+            'pool_size': list(layer.pool_size_[1:3]),
+            'strides': list(layer.strides_[1:3]),
+            'padding': layer.padding,
+        }
+        return spec, {}
+    if isinstance(layer, layers.ConcatLayer):
+        return {'type': 'concat', 'axis': layer.axis}, {}
+    if isinstance(layer, layers.DropoutLayer):
+        # dropout is the identity at inference time
+        return {'type': 'identity'}, {}
+    if isinstance(layer, layers.RecurrentLayer):
+        if layer.sequence_length is not None:
+            raise ValueError("Recurrent layers with a sequence_length are "
+                             "not supported by the numpy backend.")
+        return _get_cell_spec(layer)
+
+    raise ValueError("The layer {} is not supported by the numpy "
+                     "backend.".format(layer))
+
+
+def export_numpy(net, path):
+    """Write the architecture and the weights of a trained net to a
+    `.npz` file that can be loaded by `NumpyNet`.
+
+    Supports input, dense, 2D convolution and max pooling, concat,
+    dropout and recurrent (basic RNN, LSTM, GRU) layers. This function
+    requires tensorflow, loading the file does not.
+
+    """
+    from mink.utils import get_all_layers
+    from mink.utils import get_incomings
+
+    all_layers = get_all_layers(net.layer)
+    specs, variables = [], []
+    for layer in all_layers:
+        spec, layer_variables = _get_layer_spec(layer)
+        spec['incomings'] = [all_layers.index(incoming)
+                             for incoming in get_incomings(layer)]
+        specs.append(spec)
+        variables.append(layer_variables)
+
+    if isinstance(net.layer, list):
+        output = len(all_layers) - 1
+    else:
+        output = all_layers.index(net.layer)
+
+    keys = [(i, role) for i, layer_variables in enumerate(variables)
+            for role in layer_variables]
+    values = net._get_variable_values(
+        [variables[i][role] for i, role in keys])
+    arrays = {'{}/{}'.format(i, role): value
+              for (i, role), value in zip(keys, values)}
+
+    spec = {
+        'layers': specs,
+        'output': output,
+        'is_classifier': net._estimator_type == 'classifier',
+    }
+    np.savez(path, __spec__=np.array(json.dumps(spec)), **arrays)
+
+
+def _windows(X, kernel, strides):
+    """A view of all windows of the images, with shape
+    (batch, out_height, out_width, kernel_height, kernel_width,
+    channels).
+
+    """
+    num, height, width, channels = X.shape
+    kernel_height, kernel_width = kernel
+    stride_height, stride_width = strides
+    shape = (
+        num,
+        (height - kernel_height) // stride_height + 1,
+        (width - kernel_width) // stride_width + 1,
+        kernel_height,
+        kernel_width,
+        channels,
+    )
+    s0, s1, s2, s3 = X.strides
+    return as_strided(
+        X,
+        shape=shape,
+        strides=(s0, s1 * stride_height, s2 * stride_width, s1, s2, s3),
+        writeable=False,
+    )
+
+
+def _pad_same(X, kernel, strides, value):
+    """Pad the images like tensorflow's 'SAME' padding does."""
+    pads = [(0, 0)]
+    for size, k, s in zip(X.shape[1:3], kernel, strides):
+        out_size = -(-size // s)
+        total = max((out_size - 1) * s + k - size, 0)
+        pads.append((total // 2, total - total // 2))
+    pads.append((0, 0))
+    return np.pad(X, pads, mode='constant', constant_values=value)
+
+
+def _conv2d(X, W, b, strides, padding):
+    if padding == 'SAME':
+        X = _pad_same(X, W.shape[:2], strides, 0)
+    windows = _windows(X, W.shape[:2], strides)
+    return np.tensordot(windows, W, axes=([3, 4, 5], [0, 1, 2])) + b
+
+
+def _maxpool2d(X, pool_size, strides, padding):
+    if padding == 'SAME':
+        X = _pad_same(X, pool_size, strides, -np.inf)
+    return _windows(X, pool_size, strides).max(axis=(3, 4))
+
+
+def _recurrent(X, spec, weights):
+    """Run a recurrent cell over the time steps (axis 1) of X,
+    starting from a zero state, and return the outputs of all steps.
+
+    """
+    nonlinearity = _NONLINEARITIES[spec['nonlinearity']]
+    num_units = spec['num_units']
+    h = np.zeros((X.shape[0], num_units), dtype=X.dtype)
+    c = np.zeros_like(h)
+    outputs = np.empty((X.shape[0], X.shape[1], num_units), dtype=X.dtype)
+
+    for t in range(X.shape[1]):
+        xh = np.concatenate([X[:, t], h], axis=1)
+        if spec['type'] == 'rnn':
+            h = nonlinearity(xh.dot(weights['W']) + weights['b'])
+        elif spec['type'] == 'lstm':
+            i, j, f, o = np.split(xh.dot(weights['W']) + weights['b'], 4,
+                                  axis=1)
+            if 'w_f' in weights:
+                f = f + weights['w_f'] * c
+                i = i + weights['w_i'] * c
+            c = (_sigmoid(f + spec['forget_bias']) * c +
+                 _sigmoid(i) * nonlinearity(j))
+            if spec['cell_clip'] is not None:
+                c = np.clip(c, -spec['cell_clip'], spec['cell_clip'])
+            if 'w_o' in weights:
+                o = o + weights['w_o'] * c
+            h = _sigmoid(o) * nonlinearity(c)
+        else:
+            gates = _sigmoid(xh.dot(weights['W_gates']) + weights['b_gates'])
+            r, u = np.split(gates, 2, axis=1)
+            xrh = np.concatenate([X[:, t], r * h], axis=1)
+            candidate = nonlinearity(
+                xrh.dot(weights['W_candidate']) + weights['b_candidate'])
+            h = u * h + (1 - u) * candidate
+        outputs[:, t] = h
+    return outputs
+
+
+class NumpyNet:
+    """Make predictions with a net written by `export_numpy`, using
+    only numpy.
+
+    Parameters
+    ----------
+    path : str
+        Path to the `.npz` file.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as data:
+            spec = json.loads(str(data['__spec__']))
+            weights = [{} for _ in spec['layers']]
+            for key in data.files:
+                if key == '__spec__':
+                    continue
+                i, role = key.split('/', 1)
+                weights[int(i)][role] = data[key]
+        self.spec_ = spec
+        self.weights_ = weights
+
+    def _forward(self, X):
+        outputs = {}
+
+        def get_output(i):
+            if i not in outputs:
+                outputs[i] = self._transform(
+                    i, [get_output(j) for j in
+                        self.spec_['layers'][i]['incomings']], X)
+            return outputs[i]
+
+        return get_output(self.spec_['output'])
+
+    def _transform(self, i, Xs_incs, X):
+        spec, weights = self.spec_['layers'][i], self.weights_[i]
+        kind = spec['type']
+
+        if kind == 'input':
+            return np.asarray(X, dtype=np.float32)
+        if kind == 'concat':
+            return np.concatenate(Xs_incs, axis=spec['axis'])
+
+        X_inc = Xs_incs[0]
+        if kind == 'identity':
+            return X_inc
+        if kind == 'dense':
+            X_inc = X_inc.reshape(len(X_inc), -1)
+            activation = X_inc.dot(weights['W']) + weights['b']
+        elif kind == 'conv2d':
+            activation = _conv2d(X_inc, weights['W'], weights['b'],
+                                 spec['strides'], spec['padding'])
+        elif kind == 'maxpool2d':
+            return _maxpool2d(X_inc, spec['pool_size'], spec['strides'],
+                              spec['padding'])
+        else:
+            return _recurrent(X_inc, spec, weights)
+        return _NONLINEARITIES[spec['nonlinearity']](activation)
+
+    def predict_proba(self, X):
+        """The output of the net, i.e. the class probabilities for
+        classifiers.
+
+        """
+        return self._forward(X)
+
+    def predict(self, X):
+        """The class indices for classifiers, the output of the net
+        for regressors.
+
+        """
+        y_pred = self._forward(X)
+        if self.spec_['is_classifier']:
+            return np.argmax(y_pred, axis=1)
+        return y_pred
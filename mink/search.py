@@ -0,0 +1,409 @@
+"""Contains hyperparameter searches that are tailored to mink nets."""
+
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+
+import numpy as np
+from sklearn.base import BaseEstimator
+from sklearn.base import clone
+from sklearn.base import is_classifier
+from sklearn.metrics.scorer import check_scoring
+from sklearn.model_selection import ParameterGrid
+from sklearn.model_selection import check_cv
+from sklearn.model_selection import train_test_split
+import tensorflow as tf
+
+from mink.data import as_array
+from mink.handlers import Handler
+from mink.iterators import _attach_input
+from mink.iterators import _make_shared_dir
+from mink.iterators import _share_input
+
+
+__all__ = ['ParallelSearch', 'SuccessiveHalvingSearch']
+
+
+class ParallelSearch(BaseEstimator):
+    """Exhaustive search over a grid of parameters of a mink net,
+    similar to sklearn's GridSearchCV.
+
+    All candidates and folds are run on one pool of worker processes
+    that lives as long as the search. The estimator and the data are
+    sent to each worker only once; the data is written to a
+    memory-mapped file (in /dev/shm if available), or reopened from
+    disk if it is memory-mapped already. The cores are
+    split evenly between the workers by limiting the thread pools of
+    each worker's tensorflow session.
+
+    Parameters
+    ----------
+    estimator : NeuralNetClassifier or NeuralNetRegressor
+        The net whose parameters are searched.
+
+    param_grid : dict or list of dicts
+        Parameter names mapped to lists of values to try, as for
+        sklearn's ParameterGrid.
+
+    scoring : str, callable or None (default=None)
+        The score to maximize. If None, the `score` method of the
+        estimator is used.
+
+    cv : int, cross-validation generator or iterable (default=3)
+        Determines the cross-validation splits, as for sklearn's
+        GridSearchCV.
+
+    n_jobs : int (default=1)
+        Number of worker processes. Negative values are counted from
+        the number of cpus, i.e. -1 uses all cpus. With 1, all
+        candidates are trained in the calling process.
+
+    refit : bool (default=True)
+        Whether to fit the best candidate on the whole data
+        afterwards.
+
+    Attributes
+    ----------
+    cv_results_ : dict
+        The parameters and test scores of all candidates.
+
+    train_histories_ : dict
+        Maps (candidate index, split index) to the `train_history_`
+        of that fit. The entries are added while the nets train, one
+        epoch at a time.
+
+    best_index_, best_params_, best_score_ : int, dict, float
+        The best candidate.
+
+    best_estimator_ : estimator
+        The best candidate, fitted on the whole data (only if
+        `refit=True`).
+
+    """
+    def __init__(
+            self,
+            estimator,
+            param_grid,
+            scoring=None,
+            cv=3,
+            n_jobs=1,
+            refit=True,
+    ):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.refit = refit
+
+    def _get_n_jobs(self, num_tasks):
+        num_cpus = os.cpu_count() or 1
+        if self.n_jobs < 0:
+            n_jobs = max(num_cpus + 1 + self.n_jobs, 1)
+        else:
+            n_jobs = self.n_jobs or 1
+        return max(min(n_jobs, num_tasks), 1)
+
+    def fit(self, X, y):
+        """Fit and score all candidates on all splits."""
+        X, y = as_array(X), np.asarray(y)
+        cv = check_cv(self.cv, y, classifier=is_classifier(self.estimator))
+        splits = list(cv.split(X, y))
+        candidates = list(ParameterGrid(self.param_grid))
+        tasks = [(i, j, params, train, test)
+                 for i, params in enumerate(candidates)
+                 for j, (train, test) in enumerate(splits)]
+
+        self.train_histories_ = {(i, j): [] for i, j, *_ in tasks}
+        n_jobs = self._get_n_jobs(len(tasks))
+        if n_jobs == 1:
+            scores = self._run_sequential(X, y, tasks)
+        else:
+            scores = self._run_parallel(X, y, tasks, n_jobs)
+
+        self._store_results(candidates, len(splits), scores)
+
+        if self.refit:
+            best_estimator = clone(self.estimator)
+            best_estimator.set_params(**self.best_params_)
+            best_estimator.fit(X, y)
+            self.best_estimator_ = best_estimator
+        return self
+
+    def _run_sequential(self, X, y, tasks):
+        history_queue = queue.Queue()
+        _worker_state.update({
+            'estimator': self.estimator,
+            'X': X,
+            'y': y,
+            'queue': history_queue,
+            'num_threads': None,
+        })
+        listener = self._start_listener(history_queue)
+        try:
+            return {(i, j): _fit_and_score(i, j, params, train, test,
+                                           self.scoring)
+                    for i, j, params, train, test in tasks}
+        finally:
+            history_queue.put(None)
+            listener.join()
+            _worker_state.clear()
+
+    def _run_parallel(self, X, y, tasks, n_jobs):
+        # forked workers would inherit tensorflow's threads in an
+        # unusable state
+        context = multiprocessing.get_context('spawn')
+        history_queue = context.Queue()
+        num_threads = max((os.cpu_count() or 1) // n_jobs, 1)
+
+        shared_dir = _make_shared_dir()
+        specs = [_share_input(arr, shared_dir) for arr in (X, y)]
+        listener = self._start_listener(history_queue)
+        pool = context.Pool(
+            n_jobs,
+            initializer=_init_search_worker,
+            initargs=(self.estimator, specs, history_queue, num_threads),
+        )
+        try:
+            results = {
+                (i, j): pool.apply_async(
+                    _fit_and_score,
+                    (i, j, params, train, test, self.scoring))
+                for i, j, params, train, test in tasks}
+            scores = {key: result.get() for key, result in results.items()}
+            # let the workers exit normally, so that they send their
+            # remaining history entries
+            pool.close()
+            pool.join()
+            return scores
+        finally:
+            pool.terminate()
+            pool.join()
+            history_queue.put(None)
+            listener.join()
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+    def _start_listener(self, history_queue):
+        def listen():
+            for key, info in iter(history_queue.get, None):
+                self.train_histories_[key].append(info)
+
+        listener = threading.Thread(target=listen, daemon=True)
+        listener.start()
+        return listener
+
+    def _store_results(self, candidates, num_splits, scores):
+        split_scores = np.array([
+            [scores[i, j] for j in range(num_splits)]
+            for i in range(len(candidates))])
+        mean_scores = split_scores.mean(axis=1)
+        ranks = np.argsort(np.argsort(-mean_scores)) + 1
+
+        cv_results = {'params': candidates}
+        for j in range(num_splits):
+            cv_results['split{}_test_score'.format(j)] = split_scores[:, j]
+        cv_results['mean_test_score'] = mean_scores
+        cv_results['std_test_score'] = split_scores.std(axis=1)
+        cv_results['rank_test_score'] = ranks
+
+        self.cv_results_ = cv_results
+        self.best_index_ = int(np.argmax(mean_scores))
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = mean_scores[self.best_index_]
+
+
+class SuccessiveHalvingSearch(BaseEstimator):
+    """Search over a grid of parameters of a mink net by successive
+    halving.
+
+    All candidates are trained for a few epochs and scored on a
+    validation split. Only the best `1 / eta` of them survive to the
+    next rung, where they continue training from their current
+    weights for `eta` times as many epochs in total, and so on, until
+    one candidate is left or `max_epochs` is reached. Compared to an
+    exhaustive search, most of the compute goes to the promising
+    candidates.
+
+    Parameters
+    ----------
+    estimator : NeuralNetClassifier or NeuralNetRegressor
+        The net whose parameters are searched.
+
+    param_grid : dict or list of dicts
+        Parameter names mapped to lists of values to try, as for
+        sklearn's ParameterGrid.
+
+    scoring : str, callable or None (default=None)
+        The score to maximize on the validation split. If None, the
+        `score` method of the estimator is used.
+
+    min_epochs : int (default=1)
+        Number of epochs that all candidates are trained for in the
+        first rung.
+
+    max_epochs : int or None (default=None)
+        Maximum number of epochs that a candidate is trained for in
+        total. If None, the `max_epochs` of the estimator is used.
+
+    eta : int (default=3)
+        Factor by which the number of candidates is reduced, and the
+        number of epochs is increased, from one rung to the next.
+
+    validation_size : float (default=0.2)
+        Fraction of the data that is held out for scoring. For
+        classifiers, the split is stratified.
+
+    random_state : int or None (default=None)
+        Seed of the validation split.
+
+    Attributes
+    ----------
+    history_ : list of dicts
+        For each rung, the total number of epochs trained, and the
+        indices, parameters and validation scores of the candidates.
+
+    best_index_, best_params_, best_score_ : int, dict, float
+        The best candidate of the last rung.
+
+    best_estimator_ : estimator
+        The net of the best candidate, as trained during the search.
+
+    """
+    def __init__(
+            self,
+            estimator,
+            param_grid,
+            scoring=None,
+            min_epochs=1,
+            max_epochs=None,
+            eta=3,
+            validation_size=0.2,
+            random_state=None,
+    ):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.min_epochs = min_epochs
+        self.max_epochs = max_epochs
+        self.eta = eta
+        self.validation_size = validation_size
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        """Train and prune the candidates rung by rung."""
+        if self.eta < 2:
+            raise ValueError("eta must be at least 2, got {}.".format(
+                self.eta))
+
+        X, y = as_array(X), np.asarray(y)
+        X_train, X_valid, y_train, y_valid = train_test_split(
+            X, y,
+            test_size=self.validation_size,
+            random_state=self.random_state,
+            stratify=y if is_classifier(self.estimator) else None,
+        )
+        max_epochs = self.max_epochs or self.estimator.max_epochs
+
+        candidates = list(ParameterGrid(self.param_grid))
+        nets = {}
+        for i, params in enumerate(candidates):
+            nets[i] = clone(self.estimator).set_params(**params)
+
+        history = []
+        epochs_done, epochs = 0, min(self.min_epochs, max_epochs)
+        while True:
+            scores = []
+            for net in nets.values():
+                net.fit(X_train, y_train, epochs=epochs - epochs_done)
+                scorer = check_scoring(net, scoring=self.scoring)
+                scores.append(scorer(net, X_valid, y_valid))
+            epochs_done = epochs
+
+            history.append({
+                'rung': len(history),
+                'epochs': epochs_done,
+                'candidates': list(nets),
+                'params': [candidates[i] for i in nets],
+                'scores': scores,
+            })
+            if (len(nets) == 1) or (epochs_done >= max_epochs):
+                break
+
+            num_keep = max(len(nets) // self.eta, 1)
+            ranked = [list(nets)[k] for k in np.argsort(scores)[::-1]]
+            for i in ranked[num_keep:]:
+                nets.pop(i).close()
+            nets = {i: nets[i] for i in sorted(ranked[:num_keep])}
+            epochs = min(epochs_done * self.eta, max_epochs)
+
+        best = int(np.argmax(scores))
+        self.best_index_ = history[-1]['candidates'][best]
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = scores[best]
+        self.best_estimator_ = nets[self.best_index_]
+        for i, net in nets.items():
+            if i != self.best_index_:
+                net.close()
+        self.history_ = history
+        return self
+
+
+class _StreamHistory(Handler):
+    """Send each new entry of the net's `train_history_` to a queue."""
+    def __init__(self, history_queue, key):
+        self.history_queue = history_queue
+        self.key = key
+
+    def __call__(self, net):
+        self.history_queue.put((self.key, dict(net.train_history_[-1])))
+
+
+def _get_session_kwargs(session_kwargs, num_threads):
+    """Add thread limits to the config of the session kwargs."""
+    session_kwargs = dict(session_kwargs or {})
+    if num_threads is None:
+        return session_kwargs
+
+    config = tf.ConfigProto()
+    if session_kwargs.get('config') is not None:
+        config.CopyFrom(session_kwargs['config'])
+    config.intra_op_parallelism_threads = num_threads
+    config.inter_op_parallelism_threads = num_threads
+    session_kwargs['config'] = config
+    return session_kwargs
+
+
+# state of a ParallelSearch worker process
+_worker_state = {}
+
+
+def _init_search_worker(estimator, specs, history_queue, num_threads):
+    X, y = [_attach_input(spec) for spec in specs]
+    _worker_state.update({
+        'estimator': estimator,
+        'X': X,
+        'y': y,
+        'queue': history_queue,
+        'num_threads': num_threads,
+    })
+
+
+def _fit_and_score(i, j, params, train, test, scoring):
+    X, y = _worker_state['X'], _worker_state['y']
+
+    net = clone(_worker_state['estimator'])
+    net.set_params(**params)
+    net.set_params(
+        session_kwargs=_get_session_kwargs(
+            net.session_kwargs, _worker_state['num_threads']),
+        on_epoch_finished=list(net.on_epoch_finished or []) + [
+            _StreamHistory(_worker_state['queue'], (i, j))],
+    )
+    try:
+        net.fit(X[train], y[train])
+        scorer = check_scoring(net, scoring=scoring)
+        return scorer(net, X[test], y[test])
+    finally:
+        net.close()
@@ -0,0 +1,88 @@
+# pylint: disable=invalid-name,missing-docstring,no-self-use
+# pylint: disable=old-style-class,no-init
+
+import numpy as np
+import pytest
+
+
+class TestShardedArray:
+    @pytest.fixture
+    def X(self):
+        return np.arange(300).reshape(100, 3).astype(np.float32)
+
+    @pytest.fixture
+    def shard_dir(self, X, tmpdir):
+        dirname = tmpdir.mkdir('shards')
+        for i, (start, stop) in enumerate([(0, 30), (30, 35), (35, 100)]):
+            np.save(str(dirname.join('shard_%02d.npy' % i)), X[start:stop])
+        return str(dirname)
+
+    @pytest.fixture
+    def sharded(self, shard_dir):
+        from mink.data import ShardedArray
+        return ShardedArray.from_dir(shard_dir)
+
+    def test_shape_and_dtype(self, sharded, X):
+        assert sharded.shape == X.shape
+        assert sharded.dtype == X.dtype
+        assert len(sharded) == len(X)
+
+    @pytest.mark.parametrize('key', [
+        slice(0, 10), slice(25, 40), slice(90, 200), slice(None),
+        slice(1, 80, 7), slice(100, 120),
+    ])
+    def test_slicing(self, sharded, X, key):
+        assert np.allclose(sharded[key], X[key])
+
+    def test_index_array(self, sharded, X):
+        indices = np.random.RandomState(0).permutation(100)[:50]
+        assert np.allclose(sharded[indices], X[indices])
+
+    def test_int_index(self, sharded, X):
+        assert np.allclose(sharded[32], X[32])
+        assert np.allclose(sharded[-1], X[-1])
+
+    def test_pickle(self, sharded, X):
+        import pickle
+        loaded = pickle.loads(pickle.dumps(sharded))
+        assert np.allclose(loaded[20:40], X[20:40])
+
+    def test_as_array(self, shard_dir, X, tmpdir):
+        from mink.data import ShardedArray
+        from mink.data import as_array
+
+        path = str(tmpdir.join('X.npy'))
+        np.save(path, X)
+
+        assert isinstance(as_array(path), np.memmap)
+        assert np.allclose(as_array(path), X)
+        assert isinstance(as_array(shard_dir), ShardedArray)
+        assert as_array(X) is X
+
+    @pytest.mark.parametrize('kwargs', [
+        {},
+        {'shuffle': True},
+        {'backend': 'process', 'n_workers': 2},
+        {'backend': 'process', 'n_workers': 2, 'shuffle': True},
+    ])
+    @pytest.mark.parametrize('use_memmap', [False, True])
+    def test_iterator_pipeline_on_disk(
+            self, sharded, X, tmpdir, kwargs, use_memmap):
+        from mink.iterators import IteratorPipeline
+
+        if use_memmap:
+            path = str(tmpdir.join('X.npy'))
+            np.save(path, X)
+            # use a view to make sure that offsets are handled
+            inputs = np.load(path, mmap_mode='r')[10:], X[10:, 0]
+        else:
+            inputs = sharded, X[:, 0]
+
+        pipe = IteratorPipeline(batch_size=16, **kwargs)
+        pipe.fit(*inputs)
+        batches = [(Xb.copy(), yb.copy()) for Xb, yb in pipe(*inputs)]
+        Xt = np.vstack([Xb for Xb, _ in batches])
+        yt = np.concatenate([yb for _, yb in batches])
+
+        assert np.allclose(Xt[:, 0], yt)
+        assert np.allclose(np.sort(yt), inputs[1])
@@ -1,15 +1,30 @@
 # pylint: disable=invalid-name,missing-docstring,no-self-use
 # pylint: disable=old-style-class,no-init
 
+import json
+import os
 import pickle
 from unittest.mock import patch
 
 import numpy as np
 import pytest
+from sklearn.base import clone
 from sklearn.metrics import accuracy_score
 from sklearn.metrics import mean_squared_error
 
 
+@pytest.fixture
+def net(session_kwargs):
+    from mink import NeuralNetClassifier
+    from mink import layers
+
+    l = layers.InputLayer()
+    l = layers.DenseLayer(l, num_units=20)
+    l = layers.DropoutLayer(l)
+    l = layers.DenseLayer(l)
+    return NeuralNetClassifier(l, session_kwargs=session_kwargs)
+
+
 class TestSaveLoadModel:
     @pytest.fixture
     def net_cls(self):
@@ -51,13 +66,55 @@ class TestSaveLoadModel:
         score_after = accuracy_score(y, new_net.predict(X))
         assert score_after - score_before > 0.05
 
+    @pytest.mark.parametrize('mmap_mode', ['r', None])
+    def test_save_load(self, net_cls, clf_net, clf_data, tmpdir, mmap_mode):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=10)
+        y_proba = clf_net.predict_proba(X)
+
+        path = str(tmpdir.join('model'))
+        clf_net.save(path)
+        new_net = net_cls.load(path, mmap_mode=mmap_mode)
+
+        assert isinstance(new_net, net_cls)
+        assert np.allclose(new_net.predict_proba(X), y_proba)
+        new_net.fit(X, y, epochs=1)
+
+    def test_saved_weights_are_aligned(self, clf_net, clf_data, tmpdir):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=1)
+        path = str(tmpdir.join('model'))
+        clf_net.save(path)
+
+        with open(str(tmpdir.join('model', 'spec.pkl')), 'rb') as f:
+            spec = pickle.load(f)
+        assert '_all_params' not in spec['state']
+        assert len(spec['weights']) == 4
+        assert all(offset % 64 == 0 for *_, offset in spec['weights'])
+
+    def test_save_load_unfitted(self, net_cls, clf_net, clf_data, tmpdir):
+        path = str(tmpdir.join('model'))
+        clf_net.save(path)
+        new_net = net_cls.load(path)
+
+        X, y = clf_data
+        new_net.fit(X, y, epochs=1)
+
+    def test_pickle_unfitted_net(self, clf_net, clf_data):
+        new_net = pickle.loads(pickle.dumps(clf_net))
+        assert not hasattr(new_net, 'session_')
+
+        X, y = clf_data
+        new_net.fit(X, y, epochs=1)
+
     def test_load_params_from_other_model(
             self, net_cls, clf_net, clf_data, _layers):
         X, y = clf_data
         clf_net.fit(X, y, epochs=10)
         score_before = accuracy_score(y, clf_net.predict(X))
 
-        new_net = net_cls(_layers)
+        # layers cannot be shared with a net that is in use
+        new_net = net_cls(clone(_layers))
         new_net.initialize(X, y)
         score_init = accuracy_score(y, new_net.predict(X))
         assert not np.isclose(score_init, score_before)
@@ -67,6 +124,398 @@ class TestSaveLoadModel:
         assert np.isclose(score_after, score_before)
 
 
+class TestGetAllParams:
+    def test_single_session_run(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=1)
+        session = clf_net.session_
+
+        with patch.object(session, 'run', wraps=session.run) as run:
+            all_params = clf_net.get_all_params()
+
+        assert run.call_count == 1
+        assert [sorted(params) for params in all_params] == [
+            [], ['W_', 'b_'], ['W_', 'b_']]
+        assert all_params[1]['W_'].shape == (20, 50)
+
+    def test_greeting_does_not_fetch_weights(self, clf_net, clf_data):
+        from mink.handlers import PrintLayerInfo
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=1)
+        num_params = sum(
+            val.size for params in clf_net.get_all_params()
+            for val in params.values())
+        session = clf_net.session_
+
+        with patch.object(session, 'run', wraps=session.run) as run:
+            greeting = PrintLayerInfo.get_greeting(clf_net)
+
+        assert run.call_count == 0
+        assert "with {} learnable".format(num_params) in greeting
+
+
+class TestSetAllParams:
+    def test_restore_does_not_grow_graph(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=1)
+        all_params = clf_net.get_all_params()
+
+        clf_net.set_all_params(all_params)
+        num_ops = len(clf_net.graph_.get_operations())
+        for _ in range(3):
+            clf_net.set_all_params(all_params)
+        assert len(clf_net.graph_.get_operations()) == num_ops
+
+    def test_restore_values(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=1)
+        all_params = clf_net.get_all_params()
+        y_proba = clf_net.predict_proba(X)
+
+        clf_net.fit(X, y, epochs=2)
+        assert not np.allclose(clf_net.predict_proba(X), y_proba)
+
+        clf_net.set_all_params(all_params)
+        assert np.allclose(clf_net.predict_proba(X), y_proba)
+        for before, after in zip(all_params, clf_net.get_all_params()):
+            for key in before:
+                assert np.allclose(before[key], after[key])
+
+
+class TestCheckpoint:
+    @pytest.fixture
+    def checkpoint_cls(self):
+        from mink.handlers import Checkpoint
+        return Checkpoint
+
+    @pytest.fixture
+    def make_net(self, session_kwargs):
+        from mink import NeuralNetClassifier
+        from mink import layers
+        from mink.updates import Momentum
+
+        def make_net(checkpoint):
+            l = layers.InputLayer()
+            l = layers.DenseLayer(l, num_units=20)
+            l = layers.DenseLayer(l)
+            return NeuralNetClassifier(
+                l,
+                update=Momentum(),
+                on_epoch_finished=[checkpoint],
+                session_kwargs=session_kwargs,
+            )
+        return make_net
+
+    def test_keeps_last_checkpoints(
+            self, checkpoint_cls, make_net, clf_data, tmpdir):
+        X, y = clf_data
+        checkpoint = checkpoint_cls(str(tmpdir), every=2, keep=2)
+        make_net(checkpoint).fit(X, y, epochs=7)
+
+        filenames = [os.path.basename(filename) for filename
+                     in checkpoint.get_checkpoints()]
+        assert filenames == ['checkpoint-000004.pkl', 'checkpoint-000006.pkl']
+        assert not tmpdir.listdir('*.tmp')
+
+    def test_resume_on_fresh_net(
+            self, checkpoint_cls, make_net, clf_data, tmpdir):
+        X, y = clf_data
+        net = make_net(checkpoint_cls(str(tmpdir)))
+        net.fit(X, y, epochs=3)
+        y_proba = net.predict_proba(X)
+
+        new_net = make_net(checkpoint_cls(str(tmpdir)))
+        new_net.fit(X, y, epochs=3)
+        assert len(new_net.train_history_) == 3
+        assert np.allclose(new_net.predict_proba(X), y_proba)
+
+        new_net = make_net(checkpoint_cls(str(tmpdir)))
+        new_net.fit(X, y, epochs=5)
+        assert [info['epoch'] for info in new_net.train_history_] == [
+            1, 2, 3, 4, 5]
+        losses = [info['train loss'] for info in net.train_history_]
+        assert [info['train loss'] for info in new_net.train_history_[:3]
+                ] == losses
+
+    def test_no_resume(self, checkpoint_cls, make_net, clf_data, tmpdir):
+        X, y = clf_data
+        make_net(checkpoint_cls(str(tmpdir))).fit(X, y, epochs=2)
+
+        new_net = make_net(checkpoint_cls(str(tmpdir), resume=False))
+        new_net.fit(X, y, epochs=1)
+        assert len(new_net.train_history_) == 1
+
+    def test_optimizer_slots_are_saved(
+            self, checkpoint_cls, make_net, clf_data, tmpdir):
+        X, y = clf_data
+        checkpoint = checkpoint_cls(str(tmpdir))
+        make_net(checkpoint).fit(X, y, epochs=1)
+
+        with open(checkpoint.get_checkpoints()[-1], 'rb') as f:
+            state = pickle.load(f)
+        assert any('Momentum' in name for name in state['variables'])
+
+
+class TestEarlyStopping:
+    @pytest.fixture
+    def fit(self, _layers, session_kwargs, clf_data):
+        from mink import NeuralNetClassifier
+        X, y = clf_data
+
+        def fit(scores, early_stopping):
+            """Fit with the given 'valid loss' per epoch and return the
+            net together with its predictions after each epoch.
+
+            """
+            probas = []
+
+            def add_score(net):
+                info = net.train_history_[-1]
+                info['valid loss'] = scores[info['epoch'] - 1]
+                probas.append(net.predict_proba(X))
+
+            net = NeuralNetClassifier(
+                _layers,
+                on_epoch_finished=[add_score, early_stopping],
+                session_kwargs=session_kwargs,
+            )
+            net.fit(X, y, epochs=len(scores))
+            return net, probas
+        return fit
+
+    def test_stops_after_patience(self, fit):
+        from mink.handlers import EarlyStopping
+        net, _ = fit([1.0, 0.5, 0.6, 0.7, 0.8, 0.9], EarlyStopping(patience=2))
+        assert len(net.train_history_) == 4
+
+    def test_restores_best_weights(self, fit, clf_data):
+        from mink.handlers import EarlyStopping
+        X, _ = clf_data
+        net, probas = fit([1.0, 0.5, 0.6, 0.7, 0.8], EarlyStopping(patience=3))
+
+        assert len(net.train_history_) == 5
+        assert not np.allclose(net.predict_proba(X), probas[-1])
+        assert np.allclose(net.predict_proba(X), probas[1])
+
+    def test_min_delta(self, fit):
+        from mink.handlers import EarlyStopping
+        net, _ = fit([1.0, 0.99, 0.98, 0.97, 0.96],
+                     EarlyStopping(patience=2, min_delta=0.1))
+        assert len(net.train_history_) == 3
+
+    def test_stops_in_next_fit(self, fit, clf_data):
+        from mink.handlers import EarlyStopping
+        X, y = clf_data
+        scores = [1.0, 0.5, 0.6]
+        net, _ = fit(scores, EarlyStopping(patience=2))
+        assert len(net.train_history_) == 3
+
+        # the epochs of the next fit are numbered from 1 again
+        scores[:] = [1.0, 1.1, 1.2, 1.3, 1.4]
+        net.fit(X, y, epochs=5)
+        assert len(net.train_history_) == 6
+
+    def test_scores_from_background(self, _layers, clf_data, session_kwargs):
+        from mink import NeuralNetClassifier
+        from mink.handlers import EarlyStopping
+        from mink.handlers import make_classification_callbacks
+        X, y = clf_data
+        # no score after the first one counts as an improvement
+        early_stopping = EarlyStopping(patience=2, min_delta=np.inf)
+        net = NeuralNetClassifier(
+            _layers,
+            on_epoch_finished=make_classification_callbacks(
+                X[:500], y[:500], background=True) + [early_stopping],
+            session_kwargs=session_kwargs,
+        )
+        net.fit(X, y, epochs=20)
+
+        assert len(net.train_history_) < 20
+        scored = [info for info in net.train_history_ if 'valid loss' in info]
+        assert len(scored) >= 3
+
+
+class TestExportInference:
+    @pytest.mark.parametrize('batch_size', [None, 128])
+    def test_predictions_match(self, net, clf_data, tmpdir, batch_size):
+        from mink.inference import InferenceNet
+        X, y = clf_data
+        net.fit(X, y, epochs=3)
+        path = str(tmpdir.join('net.pb'))
+        net.export_inference(path)
+
+        inference_net = InferenceNet(path, batch_size=batch_size)
+        assert np.allclose(
+            inference_net.predict_proba(X), net.predict_proba(X), atol=1e-6)
+        assert (inference_net.predict(X) == net.predict(X)).all()
+
+    def test_graph_is_pruned(self, net, clf_data, tmpdir):
+        import tensorflow as tf
+        X, y = clf_data
+        net.fit(X, y, epochs=1)
+        path = str(tmpdir.join('net.pb'))
+        net.export_inference(path)
+
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        op_types = {node.op for node in graph_def.node}
+        assert 'Variable' not in op_types
+        assert 'Switch' not in op_types  # no dropout branches
+        assert not any('gradients' in node.name for node in graph_def.node)
+        assert [node.name for node in graph_def.node
+                if node.op == 'Placeholder'] == ['mink_input']
+
+    def test_export_twice_does_not_grow_graph(self, net, clf_data, tmpdir):
+        X, y = clf_data
+        net.fit(X, y, epochs=1)
+        net.export_inference(str(tmpdir.join('net0.pb')))
+        num_ops = len(net.graph_.get_operations())
+
+        net.export_inference(str(tmpdir.join('net1.pb')))
+        assert len(net.graph_.get_operations()) == num_ops
+
+
+class TestScoreHandlers:
+    @pytest.fixture
+    def make_net(self, _layers, session_kwargs):
+        from mink import NeuralNetClassifier
+        from mink.handlers import make_classification_callbacks
+
+        def make_net(X, y, **kwargs):
+            return NeuralNetClassifier(
+                _layers,
+                on_epoch_finished=make_classification_callbacks(
+                    X, y, **kwargs),
+                session_kwargs=session_kwargs,
+            )
+        return make_net
+
+    def test_background_scores_match(self, make_net, clf_data):
+        from sklearn.metrics import log_loss
+        X, y = clf_data
+        net = make_net(X[:500], y[:500], background=True)
+        net.fit(X, y, epochs=3)
+
+        history = net.train_history_
+        assert all('valid loss' in info for info in history)
+        assert np.isclose(
+            history[-1]['valid loss'],
+            log_loss(y[:500], net.predict_proba(X[:500])),
+            rtol=1e-5,
+        )
+        assert np.isclose(
+            history[-1]['valid acc'],
+            accuracy_score(y[:500], net.predict(X[:500])),
+        )
+        handler = net.on_epoch_finished[0]
+        assert handler.executor_ is None
+
+    def test_background_scores_are_printed(
+            self, make_net, clf_data, capsys):
+        X, y = clf_data
+        net = make_net(X[:500], y[:500], background=True, every=2)
+        net.set_params(verbose=1)
+        net.fit(X, y, epochs=4)
+
+        header, scored = None, set()
+        for line in capsys.readouterr()[0].splitlines():
+            cells = [cell.strip() for cell in line.strip('|').split('|')]
+            if cells[0] == 'epoch':
+                header = cells
+                continue
+            if (header is None) or (set(cells[0]) <= set('-:')):
+                continue
+
+            # all rows are aligned with the latest header
+            assert len(cells) == len(header)
+            row = dict(zip(header, cells))
+            if row.get('valid acc'):
+                scored.add(int(row['epoch']))
+        assert scored == {2, 4}
+
+    def test_rows_of_earlier_fit_are_not_printed_again(self):
+        from mink.handlers import PrintTrainProgress
+
+        handler = PrintTrainProgress()
+        handler._clear()
+        history = [
+            {'epoch': 1, 'dur': 1, 'train loss': 0.5, 'valid loss': 0.6}]
+        handler.table(history)
+
+        # the next fit numbers its epochs from 1 again, and its scores
+        # arrive late
+        history.append({'epoch': 1, 'dur': 1, 'train loss': 0.4})
+        handler.table(history)
+        history.append({'epoch': 2, 'dur': 1, 'train loss': 0.3})
+        out = handler.table(history)
+        assert '0.60000' not in out
+        assert '0.40000' not in out
+
+        history[1]['valid loss'] = 0.7
+        out = handler.table(history, updated_only=True)
+        assert '0.70000' in out
+        assert '0.60000' not in out
+
+    def test_background_iterator_is_fitted(self, _layers, clf_data,
+                                           session_kwargs):
+        from mink import NeuralNetClassifier
+        from mink.handlers import ClassificationScoreHandler
+        from mink.iterators import Iterator
+        from mink.iterators import IteratorPipeline
+        X, y = clf_data
+
+        class MeanIterator(Iterator):
+            # subtracts the mean of the data the iterator was fitted on
+            def fit(self, X, y, **kwargs):
+                self.mean_ = X.mean(axis=0)
+                return self
+
+            def transform(self, X, y, deterministic, **kwargs):
+                return X - self.mean_, y
+
+        def make_net(background):
+            handler = ClassificationScoreHandler(
+                X[:500], y[:500], background=background)
+            return NeuralNetClassifier(
+                clone(_layers),
+                batch_iterator_test=IteratorPipeline(
+                    steps=[('mean', MeanIterator())]),
+                on_epoch_finished=[handler],
+                session_kwargs=session_kwargs,
+            )
+
+        foreground, background = make_net(False), make_net(True)
+        foreground.fit(X, y, epochs=0)
+        background.fit(X, y, epochs=0)
+        background.set_all_params(foreground.get_all_params())
+        foreground.fit(X, y, epochs=1)
+        background.fit(X, y, epochs=1)
+
+        assert np.isclose(
+            foreground.train_history_[-1]['valid loss'],
+            background.train_history_[-1]['valid loss'],
+            rtol=1e-5,
+        )
+
+    @pytest.mark.parametrize('background', [False, True])
+    def test_every(self, make_net, clf_data, background):
+        X, y = clf_data
+        net = make_net(X[:500], y[:500], background=background, every=2)
+        net.fit(X, y, epochs=5)
+
+        assert [('valid acc' in info) for info in net.train_history_] == [
+            False, True, False, True, False]
+
+    def test_every_seconds(self, make_net, clf_data):
+        X, y = clf_data
+        net = make_net(X[:500], y[:500], every_seconds=3600)
+        net.fit(X, y, epochs=3)
+
+        assert [('valid acc' in info) for info in net.train_history_] == [
+            True, False, False]
+
+
 def test_call_fit_with_custom_session_kwargs(_layers, clf_data):
     X, y = clf_data
     session_kwargs = {'a': 'b'}
@@ -76,7 +525,25 @@ def test_call_fit_with_custom_session_kwargs(_layers, clf_data):
         net = NeuralNetClassifier(_layers, session_kwargs=session_kwargs)
         net.initialize(X, y)
 
-        assert mock_session.call_args_list[0][1] == session_kwargs
+        call_kwargs = mock_session.call_args_list[0][1]
+        assert call_kwargs.pop('graph') is net.graph_
+        assert call_kwargs == session_kwargs
+
+
+def test_call_fit_with_plain_function_callbacks(
+        _layers, clf_data, session_kwargs):
+    from mink import NeuralNetClassifier
+    X, y = clf_data
+    calls = []
+    net = NeuralNetClassifier(
+        _layers,
+        on_training_started=[lambda net: calls.append('started')],
+        on_epoch_finished=[lambda net: calls.append('epoch')],
+        session_kwargs=session_kwargs,
+    )
+    net.fit(X, y, epochs=2)
+
+    assert calls == ['started', 'epoch', 'epoch']
 
 
 def test_call_fit_repeatedly(clf_net, clf_data):
@@ -92,6 +559,134 @@ def test_call_fit_repeatedly(clf_net, clf_data):
     assert accuracy_before + 0.1 < accuracy_after
 
 
+class TestGraphIsolation:
+    def test_fit_does_not_grow_default_graph(
+            self, _layers, clf_data, session_kwargs):
+        import tensorflow as tf
+        from mink import NeuralNetClassifier
+        X, y = clf_data
+        num_ops = len(tf.get_default_graph().get_operations())
+
+        for _ in range(3):
+            net = NeuralNetClassifier(_layers, session_kwargs=session_kwargs)
+            net.fit(X, y, epochs=1)
+
+        assert len(tf.get_default_graph().get_operations()) == num_ops
+
+    def test_nets_sharing_layers_raises(
+            self, _layers, clf_data, session_kwargs):
+        from mink import NeuralNetClassifier
+        X, y = clf_data
+        net0 = NeuralNetClassifier(_layers, session_kwargs=session_kwargs)
+        net0.fit(X, y, epochs=5)
+        y_pred = net0.predict_proba(X)
+
+        net1 = NeuralNetClassifier(_layers, session_kwargs=session_kwargs)
+        with pytest.raises(ValueError):
+            net1.fit(X, y, epochs=1)
+        assert np.allclose(net0.predict_proba(X), y_pred)
+
+    def test_layers_taken_over_after_close(
+            self, _layers, clf_data, session_kwargs):
+        from mink import NeuralNetClassifier
+        X, y = clf_data
+        net0 = NeuralNetClassifier(_layers, session_kwargs=session_kwargs)
+        net0.fit(X, y, epochs=1)
+        net0.close()
+
+        net1 = NeuralNetClassifier(_layers, session_kwargs=session_kwargs)
+        net1.fit(X, y, epochs=1)
+        params = net1.layer_params_[-1]
+        assert all(param.graph is net1.graph_ for param in params.values())
+
+    def test_cloned_nets_stay_independent(
+            self, _layers, clf_data, session_kwargs):
+        from mink import NeuralNetClassifier
+        X, y = clf_data
+        net0 = NeuralNetClassifier(_layers, session_kwargs=session_kwargs)
+        net0.fit(X, y, epochs=5)
+        y_pred = net0.predict_proba(X)
+
+        net1 = clone(net0)
+        net1.fit(X, y, epochs=1)
+
+        assert net0.graph_ is not net1.graph_
+        assert np.allclose(net0.predict_proba(X), y_pred)
+        assert len(net0.get_all_params()) == len(net1.get_all_params())
+
+    def test_close_and_fit_again(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=1)
+        graph = clf_net.graph_
+
+        clf_net.close()
+        assert not hasattr(clf_net, 'session_')
+
+        clf_net.fit(X, y, epochs=1)
+        assert clf_net.graph_ is not graph
+
+
+class TestLiveHyperparams:
+    @pytest.fixture
+    def net(self, session_kwargs):
+        from mink import NeuralNetClassifier
+        from mink import layers
+        from mink.updates import Momentum
+
+        l = layers.InputLayer()
+        l = layers.DenseLayer(l, name='dense', num_units=20)
+        l = layers.DropoutLayer(l, name='dropout')
+        l = layers.DenseLayer(l)
+        return NeuralNetClassifier(
+            l, update=Momentum(), session_kwargs=session_kwargs)
+
+    def test_set_learning_rate_after_fit(self, net, clf_data):
+        X, y = clf_data
+        net.fit(X, y, epochs=1)
+        session = net.session_
+        num_ops = len(net.graph_.get_operations())
+        params_before = net.get_all_params()
+
+        net.set_params(update__learning_rate=0.0, update__momentum=0.0)
+        net.fit(X, y, epochs=2)
+
+        assert net.session_ is session
+        assert len(net.graph_.get_operations()) == num_ops
+        for before, after in zip(params_before, net.get_all_params()):
+            for key in before:
+                assert np.allclose(before[key], after[key])
+
+    def test_set_dropout_after_fit(self, net, clf_data):
+        X, y = clf_data
+        net.fit(X, y, epochs=1)
+        dropout = net.layer.incoming
+
+        net.set_params(dropout__p=0.2)
+        feed_dict = net._get_hyperparam_feed_dict()
+        assert feed_dict[dropout.hyperparams_['p']] == 0.2
+        assert feed_dict[net.update.hyperparams_['learning_rate']] == 0.01
+
+    def test_set_rmsprop_momentum_after_fit(self, net, clf_data):
+        from mink.updates import RMSProp
+
+        X, y = clf_data
+        net.set_params(update=RMSProp(momentum=0.5))
+        net.fit(X, y, epochs=1)
+
+        net.set_params(update__momentum=0.7)
+        feed_dict = net._get_hyperparam_feed_dict()
+        assert np.isclose(feed_dict[net.update.hyperparams_['momentum']], 0.7)
+
+    def test_pickle_with_hyperparams(self, net, clf_data):
+        X, y = clf_data
+        net.fit(X, y, epochs=1)
+        net.set_params(update__learning_rate=0.05)
+
+        new_net = pickle.loads(pickle.dumps(net))
+        new_net.fit(X, y, epochs=1)
+        assert new_net.update.learning_rate == 0.05
+
+
 class TestNeuralNetEstimatorsLearn:
     def test_neural_net_classifier_learns(self, clf_net, clf_data):
         X, y = clf_data
@@ -163,3 +758,505 @@ class TestNetIteratorPipeline:
         # does not raise
         clf_net.fit(X, y, epochs=3)
         clf_net.predict(X)
+
+
+class TestStepsPerRun:
+    @pytest.fixture
+    def net_cls(self):
+        from mink import NeuralNetClassifier
+        return NeuralNetClassifier
+
+    @pytest.mark.parametrize('steps_per_run', [2, 5])
+    def test_multi_step_net_learns(
+            self, net_cls, _layers, clf_data, session_kwargs, steps_per_run):
+        X, y = clf_data
+        net = net_cls(
+            _layers,
+            batch_iterator_train=64,
+            session_kwargs=session_kwargs,
+            steps_per_run=steps_per_run,
+        )
+
+        net.fit(X, y, epochs=0)
+        score_before = accuracy_score(y, net.predict(X))
+
+        net.fit(X, y, epochs=20)
+        score_after = accuracy_score(y, net.predict(X))
+        assert score_after > score_before + 0.1
+
+    @pytest.mark.parametrize('update', ['SGD', 'Momentum', 'Adam'])
+    def test_fused_steps_match_single_steps(
+            self, net_cls, clf_data, session_kwargs, update):
+        from mink import layers
+        from mink import updates
+        X, y = clf_data
+        # 2 runs of 4 fused steps per epoch, nothing left over
+        X, y = X[:512], y[:512]
+
+        def make_net(steps_per_run):
+            l = layers.InputLayer()
+            l = layers.DenseLayer(l, num_units=20)
+            l = layers.DenseLayer(l)
+            return net_cls(
+                l,
+                update=getattr(updates, update)(),
+                batch_iterator_train=64,
+                session_kwargs=session_kwargs,
+                steps_per_run=steps_per_run,
+            )
+
+        single, fused = make_net(1), make_net(4)
+        single.fit(X, y, epochs=0)
+        fused.fit(X, y, epochs=0)
+        fused.set_all_params(single.get_all_params())
+
+        single.fit(X, y, epochs=2)
+        fused.fit(X, y, epochs=2)
+
+        for params_single, params_fused in zip(
+                single.get_all_params(), fused.get_all_params()):
+            for key in params_single:
+                assert np.allclose(params_single[key], params_fused[key],
+                                   rtol=1e-5, atol=1e-6)
+        assert np.allclose(
+            [info['train loss'] for info in single.train_history_],
+            [info['train loss'] for info in fused.train_history_],
+            rtol=1e-5,
+        )
+
+    def test_multi_step_stacks_equal_batches(
+            self, net_cls, _layers, clf_data):
+        X, y = clf_data
+        net = net_cls(_layers, batch_iterator_train=300, steps_per_run=3)
+        net.initialize(X, y)
+
+        is_multis = [is_multi for _, _, _, is_multi
+                     in net._iter_train_batches(X, y.reshape(-1, 1))]
+        # 2000 samples: 6 batches of 300 stacked in 2 runs, then the
+        # batch of 200 on its own
+        assert is_multis == [True, True, False]
+
+
+class TestTimeBatches:
+    @pytest.fixture
+    def net_cls(self):
+        from mink import NeuralNetClassifier
+        return NeuralNetClassifier
+
+    @pytest.mark.parametrize('steps_per_run, num_runs', [(1, 7), (3, 3)])
+    def test_batch_timings(self, net_cls, _layers, clf_data, session_kwargs,
+                           steps_per_run, num_runs):
+        X, y = clf_data
+        net = net_cls(
+            _layers,
+            batch_iterator_train=300,
+            session_kwargs=session_kwargs,
+            steps_per_run=steps_per_run,
+            time_batches=True,
+        )
+        net.fit(X, y, epochs=2)
+
+        timings = net.batch_timings_
+        assert list(timings) == ['iterator', 'feed', 'run', 'samples']
+        assert all(len(values) == num_runs for values in timings.values())
+        assert timings['samples'].sum() == len(X)
+        assert (timings['run'] > 0).all()
+
+        info = net.train_history_[-1]
+        assert list(info)[-1] == 'dur'
+        assert np.isclose(info['run time'], timings['run'].sum())
+        assert info['samples/sec'] > 0
+
+    @pytest.mark.parametrize('steps_per_run', [1, 3])
+    def test_iterator_time_is_not_feed_time(
+            self, net_cls, _layers, clf_data, session_kwargs,
+            steps_per_run):
+        import time
+        from mink.iterators import FunctionIterator
+        from mink.iterators import IteratorPipeline
+        X, y = clf_data
+
+        def slow(Xb):
+            time.sleep(0.02)
+            return Xb
+
+        net = net_cls(
+            _layers,
+            batch_iterator_train=IteratorPipeline(
+                batch_size=300, steps=[('slow', FunctionIterator(slow))]),
+            session_kwargs=session_kwargs,
+            steps_per_run=steps_per_run,
+            time_batches=True,
+        )
+        net.fit(X, y, epochs=1)
+
+        timings = net.batch_timings_
+        # 7 batches per epoch
+        assert timings['iterator'].sum() >= 7 * 0.02
+        assert timings['feed'].sum() < 0.02
+
+    def test_no_timings_by_default(self, net_cls, _layers, clf_data):
+        X, y = clf_data
+        net = net_cls(_layers)
+        net.fit(X, y, epochs=1)
+
+        assert not hasattr(net, 'batch_timings_')
+        assert 'run time' not in net.train_history_[-1]
+
+
+class TestStepProfiler:
+    @pytest.fixture
+    def profiler_cls(self):
+        from mink.handlers import StepProfiler
+        return StepProfiler
+
+    def test_traces_selected_steps(
+            self, profiler_cls, _layers, clf_data, session_kwargs, tmpdir):
+        from mink import NeuralNetClassifier
+        X, y = clf_data
+        profiler = profiler_cls(steps=[0, 3], dirname=str(tmpdir))
+        net = NeuralNetClassifier(
+            _layers,
+            on_epoch_finished=[profiler],
+            session_kwargs=session_kwargs,
+        )
+        net.fit(X, y, epochs=1)
+
+        assert profiler.traced_steps_ == [0, 3]
+        assert sorted(path.basename for path in tmpdir.listdir()) == [
+            'timeline-0.json', 'timeline-3.json']
+        with open(str(tmpdir.join('timeline-3.json'))) as f:
+            assert 'traceEvents' in json.load(f)
+
+        stats = profiler.scope_stats_
+        assert sum(scope['time'] for scope in stats.values()) > 0
+        assert 'scope' in profiler.get_scope_table()
+
+    @pytest.mark.parametrize('node_name, expected', [
+        ('MatMul_3', 'MatMul'),
+        ('dense/MatMul', 'dense'),
+        ('gradients/dense/MatMul_grad/MatMul_1', 'dense'),
+    ])
+    def test_op_scope(self, node_name, expected):
+        from mink.handlers import _get_op_scope
+        assert _get_op_scope(node_name) == expected
+
+
+class TestLayerScopes:
+    def test_params_are_named_after_layers(self, net, clf_data):
+        X, y = clf_data
+        net.fit(X, y, epochs=1)
+
+        assert net.layer_scopes_ == ['input', 'dense', 'dropout', 'dense-1']
+        names = [layer_params['W_'].name for layer_params
+                 in net._get_layer_params() if 'W_' in layer_params]
+        assert names[0] == 'dense/W:0'
+        assert names[1] == 'dense-1/W:0'
+
+    def test_custom_init_without_name(self, clf_data, session_kwargs):
+        from mink import NeuralNetClassifier
+        from mink import layers
+        from mink.inits import Init
+
+        class Ones(Init):
+            def __call__(self, shape):
+                return np.ones(shape, dtype=np.float32)
+
+        X, y = clf_data
+        l = layers.InputLayer()
+        l = layers.DenseLayer(l, name='dense', W=Ones())
+        net = NeuralNetClassifier(l, session_kwargs=session_kwargs)
+        net.fit(X, y, epochs=1)
+
+        assert net.layer.W_.name == 'dense/W:0'
+
+    def test_ops_are_built_in_layer_scopes(self, net, clf_data):
+        X, y = clf_data
+        net.fit(X, y, epochs=1)
+
+        scopes = {op.name.split('/', 1)[0]
+                  for op in net.graph_.get_operations()}
+        assert {'dense', 'dropout', 'dense-1'} <= scopes
+        assert 'MatMul' not in scopes
+
+    def test_stacked_recurrent_layers(self, clf_data, session_kwargs):
+        from mink import NeuralNetClassifier
+        from mink import layers
+        X, y = clf_data
+        X = X.reshape(-1, 5, 4).astype(np.float32)
+
+        l = layers.InputLayer()
+        l = layers.LSTMLayer(l, num_units=10)
+        l = layers.LSTMLayer(l, num_units=10)
+        l = layers.DenseLayer(l)
+        net = NeuralNetClassifier(l, session_kwargs=session_kwargs)
+        net.fit(X, y, epochs=1)
+
+        names = [variable.name for variable in
+                 net._get_variables(trainable_only=True)]
+        assert any(name.startswith('lstm/') for name in names)
+        assert any(name.startswith('lstm-1/') for name in names)
+
+    def test_profiler_aggregates_per_layer(self, net, clf_data):
+        from mink.handlers import StepProfiler
+        X, y = clf_data
+        profiler = StepProfiler(steps=[1])
+        net.set_params(on_epoch_finished=[profiler])
+        net.fit(X, y, epochs=1)
+
+        assert {'dense', 'dense-1'} <= set(profiler.scope_stats_)
+
+
+class TestCacheData:
+    @pytest.fixture
+    def net_cls(self):
+        from mink import NeuralNetClassifier
+        return NeuralNetClassifier
+
+    @pytest.mark.parametrize('steps_per_run', [1, 3])
+    def test_cached_data_net_learns(
+            self, net_cls, _layers, clf_data, session_kwargs, steps_per_run):
+        X, y = clf_data
+        net = net_cls(
+            _layers,
+            session_kwargs=session_kwargs,
+            steps_per_run=steps_per_run,
+            cache_data=True,
+        )
+
+        net.fit(X, y, epochs=0)
+        score_before = accuracy_score(y, net.predict(X))
+
+        net.fit(X, y, epochs=20)
+        score_after = accuracy_score(y, net.predict(X))
+        assert score_after > score_before + 0.1
+
+    def test_cached_data_with_transform_steps_raises(
+            self, net_cls, _layers, clf_data):
+        from mink import iterators
+        X, y = clf_data
+        pipe = iterators.IteratorPipeline(
+            steps=[('noise', iterators.GaussianNoiseIterator())])
+        net = net_cls(_layers, batch_iterator_train=pipe, cache_data=True)
+
+        with pytest.raises(ValueError):
+            net.fit(X, y)
+
+    def test_cached_data_with_padding_raises(
+            self, net_cls, _layers, clf_data):
+        from mink import iterators
+        X, y = clf_data
+        pipe = iterators.IteratorPipeline(last_batch='pad')
+        net = net_cls(_layers, batch_iterator_train=pipe, cache_data=True)
+
+        with pytest.raises(ValueError):
+            net.fit(X, y)
+
+    @pytest.mark.parametrize('last_batch', ['keep', 'drop'])
+    def test_cached_data_matches_iterator(
+            self, net_cls, clf_data, session_kwargs, last_batch):
+        from mink import iterators
+        from mink import layers
+        X, y = clf_data
+        X, y = X[:500], y[:500]
+
+        def make_net(cache_data):
+            l = layers.InputLayer()
+            l = layers.DenseLayer(l, num_units=20)
+            l = layers.DenseLayer(l)
+            pipe = iterators.IteratorPipeline(
+                batch_size=64,
+                shuffle=True,
+                random_state=0,
+                last_batch=last_batch,
+            )
+            return net_cls(
+                l,
+                batch_iterator_train=pipe,
+                session_kwargs=session_kwargs,
+                cache_data=cache_data,
+            )
+
+        fed, cached = make_net(False), make_net(True)
+        fed.fit(X, y, epochs=0)
+        cached.fit(X, y, epochs=0)
+        cached.set_all_params(fed.get_all_params())
+
+        fed.fit(X, y, epochs=2)
+        cached.fit(X, y, epochs=2)
+
+        for params_fed, params_cached in zip(
+                fed.get_all_params(), cached.get_all_params()):
+            for key in params_fed:
+                assert np.allclose(params_fed[key], params_cached[key],
+                                   rtol=1e-5, atol=1e-6)
+
+    def test_cached_data_only_reloaded_on_new_data(
+            self, net_cls, _layers, clf_data, session_kwargs):
+        X, y = clf_data
+        net = net_cls(_layers, session_kwargs=session_kwargs,
+                      cache_data=True)
+        net.fit(X, y, epochs=0)
+        loaded = net.data_loaded_
+
+        net.fit(X, y, epochs=1)
+        assert net.data_loaded_ is loaded
+
+        X_new = X.copy()
+        net.fit(X_new, y, epochs=1)
+        assert net.data_loaded_[0] is X_new
+
+
+class TestStreaming:
+    @staticmethod
+    def iter_batches(X, y, batch_size=100):
+        for i in range(0, X.shape[0], batch_size):
+            yield X[i:i + batch_size], y[i:i + batch_size]
+
+    def test_fit_generator_learns(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.fit_generator(self.iter_batches(X, y), classes=np.unique(y))
+        score_before = accuracy_score(y, clf_net.predict(X))
+
+        for _ in range(20):
+            clf_net.fit_generator(self.iter_batches(X, y))
+        score_after = accuracy_score(y, clf_net.predict(X))
+        assert score_after > score_before + 0.1
+
+    def test_fit_generator_classifier_requires_classes(
+            self, clf_net, clf_data):
+        X, y = clf_data
+        with pytest.raises(ValueError):
+            clf_net.fit_generator(self.iter_batches(X, y))
+
+    def test_fit_generator_regressor(self, regr_net, regr_data):
+        X, y = regr_data
+        # does not raise
+        regr_net.fit_generator(self.iter_batches(X, y))
+        regr_net.predict(X)
+
+    def test_predict_iter(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=2)
+
+        y_proba = np.vstack(list(clf_net.predict_proba_iter(X)))
+        assert np.allclose(y_proba, clf_net.predict_proba(X))
+
+        y_pred = np.concatenate(list(clf_net.predict_iter(X)))
+        assert (y_pred == clf_net.predict(X)).all()
+
+    def test_predict_iter_on_stream_of_batches(self, regr_net, regr_data):
+        X, y = regr_data
+        regr_net.fit(X, y, epochs=2)
+
+        stream = (Xb for Xb, _ in self.iter_batches(X, y, batch_size=77))
+        y_pred = np.vstack(list(regr_net.predict_iter(stream)))
+        assert np.allclose(y_pred, regr_net.predict(X))
+
+
+class TestPartialFit:
+    def test_partial_fit_learns(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.partial_fit(X[:500], y[:500], classes=np.unique(y))
+        score_before = accuracy_score(y, clf_net.predict(X))
+
+        for _ in range(10):
+            for i in range(0, 2000, 500):
+                clf_net.partial_fit(X[i:i + 500], y[i:i + 500])
+        score_after = accuracy_score(y, clf_net.predict(X))
+        assert score_after > score_before + 0.1
+
+    def test_partial_fit_does_not_refit_encoder(self, clf_net, clf_data):
+        X, y = clf_data
+        classes = np.unique(y)
+        clf_net.partial_fit(X, y, classes=classes)
+        encoder = clf_net.encoder
+
+        # a chunk that contains only some of the classes
+        mask = y < 2
+        clf_net.partial_fit(X[mask], y[mask])
+        assert clf_net.encoder is encoder
+        assert (clf_net.classes_ == classes).all()
+        assert clf_net.predict_proba(X).shape == (len(X), len(classes))
+
+    def test_partial_fit_unknown_labels_raises(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.partial_fit(X, y, classes=np.unique(y))
+
+        with pytest.raises(ValueError):
+            clf_net.partial_fit(X, y + 100)
+
+    def test_partial_fit_classifier_requires_classes(
+            self, clf_net, clf_data):
+        X, y = clf_data
+        with pytest.raises(ValueError):
+            clf_net.partial_fit(X, y)
+
+
+class TestPredictOut:
+    def test_predict_proba_into_out(self, clf_net, clf_data):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=2)
+        y_proba = clf_net.predict_proba(X)
+        assert y_proba.shape == (len(X), len(np.unique(y)))
+
+        out = np.zeros_like(y_proba)
+        result = clf_net.predict_proba(X, out=out)
+        assert result is out
+        assert np.allclose(out, y_proba)
+
+    def test_predict_into_memmap(self, regr_net, regr_data, tmpdir):
+        X, y = regr_data
+        regr_net.fit(X, y, epochs=2)
+        y_pred = regr_net.predict(X)
+
+        out = np.memmap(str(tmpdir.join('out.dat')), dtype=np.float32,
+                        mode='w+', shape=y_pred.shape)
+        regr_net.predict(X, out=out)
+        assert np.allclose(out, y_pred)
+
+    def test_predict_into_out_wrong_shape_raises(self, regr_net, regr_data):
+        X, y = regr_data
+        regr_net.fit(X, y, epochs=1)
+
+        with pytest.raises(ValueError):
+            regr_net.predict(X, out=np.zeros((len(X) - 1, 1)))
+
+
+class TestLastBatch:
+    @pytest.fixture
+    def pipe_cls(self):
+        from mink.iterators import IteratorPipeline
+        return IteratorPipeline
+
+    def test_padded_predictions_are_stripped(
+            self, clf_net, clf_data, pipe_cls):
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=2)
+        y_proba = clf_net.predict_proba(X)
+
+        clf_net.batch_iterator_test_ = pipe_cls(
+            batch_size=300, deterministic=True, last_batch='pad')
+        assert np.allclose(clf_net.predict_proba(X), y_proba)
+        y_proba_iter = np.vstack(list(clf_net.predict_proba_iter(X)))
+        assert np.allclose(y_proba_iter, y_proba)
+
+    @pytest.mark.parametrize('last_batch', ['pad', 'drop'])
+    @pytest.mark.parametrize('steps_per_run', [1, 3])
+    def test_net_learns_with_fixed_batch_shape(
+            self, clf_net, clf_data, pipe_cls, last_batch, steps_per_run):
+        X, y = clf_data
+        clf_net.set_params(
+            batch_iterator_train=pipe_cls(
+                batch_size=300, last_batch=last_batch),
+            steps_per_run=steps_per_run,
+            verbose=1,
+        )
+
+        clf_net.fit(X, y, epochs=0)
+        score_before = accuracy_score(y, clf_net.predict(X))
+        clf_net.fit(X, y, epochs=20)
+        score_after = accuracy_score(y, clf_net.predict(X))
+
+        assert np.isfinite(clf_net.train_history_[-1]['train loss'])
+        assert score_after > score_before + 0.1
@@ -1,10 +1,31 @@
 # pylint: disable=invalid-name,missing-docstring,no-self-use
 # pylint: disable=old-style-class,no-init
 
+import os
+
 import numpy as np
 import pytest
 from sklearn.base import clone
 
+from mink.iterators import Iterator
+
+
+# defined on the module level, so that it can be sent to worker
+# processes
+class Add1Iterator(Iterator):
+    def __init__(self, to_add=1):
+        self.to_add = to_add
+
+    def transform(self, X, y, deterministic, **kwargs):
+        if not hasattr(self, '_count'):
+            self._count = 0
+
+        self._count += 1
+        if deterministic:
+            return X, y
+        else:
+            return X + self.to_add, y
+
 
 class TestIteartorPipeline:
     @pytest.fixture
@@ -14,22 +35,6 @@ class TestIteartorPipeline:
 
     @pytest.fixture(scope='function')
     def add1_iterator(self):
-        from mink.iterators import Iterator
-
-        class Add1Iterator(Iterator):
-            def __init__(self, to_add=1):
-                self.to_add = to_add
-
-            def transform(self, X, y, deterministic, **kwargs):
-                if not hasattr(self, '_count'):
-                    self._count = 0
-
-                self._count += 1
-                if deterministic:
-                    return X, y
-                else:
-                    return X + self.to_add, y
-
         return Add1Iterator()
 
     def get_iterator_pipeline(
@@ -128,6 +133,34 @@ class TestIteartorPipeline:
 
         assert np.allclose(Xt, np.zeros_like(X) + n_steps)
 
+    def test_iter_transform_into_out(self, data, tmpdir):
+        X, y = data
+        pipe = self.get_iterator_pipeline(
+            batch_size=64,
+            n_steps=2,
+            deterministic=False,
+        )
+        pipe.fit(X, y)
+        Xt = np.lib.format.open_memmap(
+            str(tmpdir.join('Xt.npy')), mode='w+', dtype=X.dtype,
+            shape=X.shape)
+        yt = np.empty_like(y)
+
+        result = pipe.iter_transform(X, y, out=(Xt, yt))
+
+        assert result[0] is Xt
+        assert np.allclose(Xt, np.zeros_like(X) + 2)
+        assert np.allclose(yt, y)
+
+    def test_iter_transform_without_y(self, data):
+        X, _ = data
+        pipe = self.get_iterator_pipeline(batch_size=64)
+        pipe.fit(X, None)
+
+        Xt, yt = pipe.iter_transform(X)
+        assert Xt.shape == X.shape
+        assert yt is None
+
     @pytest.mark.parametrize('batch_size', [1, 50, 256, 1001, 2000])
     def test_iter_number_of_iterations(self, data, batch_size):
         X, y = data
@@ -195,3 +228,223 @@ class TestIteartorPipeline:
 
         expected = n_steps - 1 + 10
         assert np.allclose(Xt, np.zeros_like(X) + expected)
+
+    @pytest.mark.parametrize('prefetch', [1, 3, 100])
+    @pytest.mark.parametrize('n_workers', [1, 4])
+    def test_iter_prefetch_batches_in_order(self, prefetch, n_workers):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        pipe = self.get_iterator_pipeline(batch_size=64, deterministic=True)
+        pipe.fit(X, y)
+        expected = list(pipe(X, y))
+
+        pipe.set_params(prefetch=prefetch, n_workers=n_workers)
+        batches = list(pipe(X, y))
+
+        assert len(batches) == len(expected)
+        for (Xb, yb), (Xe, ye) in zip(batches, expected):
+            assert np.allclose(Xb, Xe)
+            assert np.allclose(yb, ye)
+
+    @pytest.mark.parametrize('n_workers', [1, 3])
+    def test_iter_process_backend_batches_in_order(self, n_workers):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        pipe = self.get_iterator_pipeline(batch_size=64, deterministic=False)
+        pipe.fit(X, y)
+        expected = list(pipe(X, y))
+
+        pipe.set_params(backend='process', n_workers=n_workers, prefetch=2)
+        batches = list(pipe(X, y))
+
+        assert len(batches) == len(expected)
+        for (Xb, yb), (Xe, ye) in zip(batches, expected):
+            assert np.allclose(Xb, Xe)
+            assert np.allclose(yb, ye)
+
+    def test_iter_process_backend_without_y(self, data):
+        X, _ = data
+        pipe = self.get_iterator_pipeline(batch_size=64)
+        pipe.set_params(backend='process', n_workers=2)
+        pipe.fit(X, None)
+
+        batches = list(pipe(X))
+        assert np.allclose(np.vstack([Xb for Xb, _ in batches]), X + 2)
+        assert all(yb is None for _, yb in batches)
+
+    def test_iter_process_backend_reuses_workers(self):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        pipe = self.get_iterator_pipeline(batch_size=64, deterministic=True)
+        pipe.set_params(backend='process', n_workers=2, shuffle=True)
+        pipe.fit(X, y)
+
+        first = np.concatenate([yb for _, yb in pipe(X, y)])
+        pool, specs = pipe.pool_, pipe.shared_specs_
+        second = np.concatenate([yb for _, yb in pipe(X, y)])
+
+        # same workers and shared inputs, but a new order
+        assert pipe.pool_ is pool
+        assert pipe.shared_specs_ == specs
+        assert np.allclose(np.sort(first), y)
+        assert np.allclose(np.sort(second), y)
+        assert not np.allclose(first, second)
+
+        # only the files of the shared inputs are left
+        shared_dir = pipe.shared_dir_
+        assert len(os.listdir(shared_dir)) == 2
+
+        pipe.fit(X, y)
+        assert not hasattr(pipe, 'pool_')
+        assert not os.path.exists(shared_dir)
+
+    def test_iter_process_backend_unpicklable_step_raises(self, data):
+        from mink.iterators import FunctionIterator
+        X, y = data
+        pipe = self.iterator_pipeline_cls()(
+            steps=[('func', FunctionIterator(lambda X: X + 1))],
+            prefetch=1,
+            backend='process',
+        )
+        pipe.fit(X, y)
+        with pytest.raises(TypeError):
+            list(pipe(X, y))
+
+    def test_iter_process_backend_batches_are_writable(self, data):
+        X, y = data
+        pipe = self.get_iterator_pipeline(batch_size=64)
+        pipe.set_params(prefetch=1, backend='process', n_workers=2)
+        pipe.fit(X, y)
+
+        for Xb, _ in pipe(X, y):
+            assert np.allclose(Xb, 2)
+            # copy-on-write, although the file is deleted already
+            Xb += 1
+            assert np.allclose(Xb, 3)
+        pipe.close()
+
+    def test_iterator_pipeline_invalid_backend(self):
+        with pytest.raises(ValueError):
+            self.iterator_pipeline_cls()(backend='foo')
+
+    def get_shuffled_batches(self, X, y, **kwargs):
+        pipe = self.get_iterator_pipeline(
+            batch_size=64,
+            deterministic=True,
+        )
+        pipe.set_params(shuffle=True, **kwargs)
+        pipe.fit(X, y)
+        # copy because batch buffers are reused
+        return [(Xb.copy(), yb.copy()) for Xb, yb in pipe(X, y)]
+
+    @pytest.mark.parametrize('kwargs', [
+        {},
+        {'prefetch': 3, 'n_workers': 2},
+        {'backend': 'process', 'n_workers': 2},
+    ])
+    def test_iter_shuffle_is_permutation(self, kwargs):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        batches = self.get_shuffled_batches(X, y, random_state=0, **kwargs)
+
+        Xt = np.vstack([Xb for Xb, _ in batches])
+        yt = np.concatenate([yb for _, yb in batches])
+        assert [len(yb) for _, yb in batches] == [64] * 15 + [40]
+        assert np.allclose(Xt[:, 0], yt)
+        assert not np.allclose(yt, y)
+        assert np.allclose(np.sort(yt), y)
+
+    def test_iter_shuffle_random_state(self):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        batches0 = self.get_shuffled_batches(X, y, random_state=0)
+        batches1 = self.get_shuffled_batches(X, y, random_state=0)
+        batches2 = self.get_shuffled_batches(X, y, random_state=1)
+
+        for (Xb0, _), (Xb1, _) in zip(batches0, batches1):
+            assert np.allclose(Xb0, Xb1)
+        assert not np.allclose(batches0[0][0], batches2[0][0])
+
+    def test_iter_shuffle_same_order_after_refit(self):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        pipe = self.get_iterator_pipeline(batch_size=64, deterministic=True)
+        pipe.set_params(shuffle=True, random_state=0)
+
+        pipe.fit(X, y)
+        first = next(iter(pipe(X, y)))[1].copy()
+        pipe.fit(X, y)
+        second = next(iter(pipe(X, y)))[1].copy()
+        assert np.allclose(first, second)
+
+    def test_iter_shuffle_new_order_each_pass(self):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        pipe = self.get_iterator_pipeline(batch_size=64, deterministic=True)
+        pipe.set_params(shuffle=True, random_state=0)
+        pipe.fit(X, y)
+
+        first = next(iter(pipe(X, y)))[1].copy()
+        second = next(iter(pipe(X, y)))[1].copy()
+        assert not np.allclose(first, second)
+
+    @pytest.mark.parametrize('kwargs', [
+        {},
+        {'prefetch': 1},
+        {'prefetch': 3, 'n_workers': 2},
+        {'backend': 'process', 'n_workers': 2},
+    ])
+    def test_iter_shuffle_held_batch_unchanged(self, kwargs):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        pipe = self.get_iterator_pipeline(batch_size=64, deterministic=True)
+        pipe.set_params(shuffle=True, random_state=0, **kwargs)
+        pipe.fit(X, y)
+
+        previous = None
+        for Xb, yb in pipe(X, y):
+            if previous is not None:
+                # the previous batch is still valid while this one is
+                # used
+                Xp, yp, yp_copy = previous
+                assert np.allclose(yp, yp_copy)
+                assert np.allclose(Xp[:, 0], yp)
+            previous = Xb, yb, yb.copy()
+
+    @pytest.mark.parametrize('kwargs', [
+        {},
+        {'shuffle': True},
+        {'prefetch': 2, 'n_workers': 2},
+        {'backend': 'process', 'n_workers': 2},
+    ])
+    def test_iter_last_batch_pad(self, kwargs):
+        X = np.arange(1, 1001).reshape(-1, 1).astype(float)
+        y = np.arange(1, 1001)
+        pipe = self.get_iterator_pipeline(batch_size=64, deterministic=True)
+        pipe.set_params(last_batch='pad', **kwargs)
+        pipe.fit(X, y)
+
+        batches = [(Xb.copy(), yb.copy()) for Xb, yb in pipe(X, y)]
+        assert all(len(Xb) == 64 for Xb, _ in batches)
+        assert pipe.batch_lengths() == [64] * 15 + [40]
+
+        Xb, yb = batches[-1]
+        assert (Xb[40:] == 0).all()
+        assert (yb[40:] == 0).all()
+        assert (yb[:40] > 0).all()
+
+    def test_iter_last_batch_drop(self):
+        X = np.arange(1000).reshape(-1, 1).astype(float)
+        y = np.arange(1000)
+        pipe = self.get_iterator_pipeline(batch_size=64, deterministic=True)
+        pipe.set_params(last_batch='drop')
+        pipe.fit(X, y)
+
+        batches = list(pipe(X, y))
+        assert len(batches) == 15
+        assert all(len(Xb) == 64 for Xb, _ in batches)
+        assert pipe.batch_lengths() == [64] * 15
+
+    def test_iterator_pipeline_invalid_last_batch(self):
+        with pytest.raises(ValueError):
+            self.iterator_pipeline_cls()(last_batch='foo')
@@ -0,0 +1,141 @@
+# pylint: disable=invalid-name,missing-docstring,no-self-use
+# pylint: disable=old-style-class,no-init
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+
+from mink import NeuralNetClassifier
+from mink import NeuralNetRegressor
+from mink import layers
+
+
+class TestNumpyNet:
+    @pytest.fixture
+    def export(self, tmpdir):
+        from mink.numpy_backend import export_numpy
+        from mink.numpy_backend import NumpyNet
+
+        def export(net):
+            path = str(tmpdir.join('net.npz'))
+            export_numpy(net, path)
+            return NumpyNet(path)
+        return export
+
+    @pytest.fixture
+    def image_data(self):
+        X, y = make_classification(
+            n_samples=200, n_features=7 * 7 * 2, n_classes=3,
+            n_informative=10, random_state=0)
+        return X.reshape(-1, 7, 7, 2).astype(np.float32), y
+
+    @pytest.fixture
+    def sequence_data(self):
+        X, y = make_classification(
+            n_samples=200, n_features=5 * 3, n_classes=3,
+            n_informative=10, random_state=0)
+        return X.reshape(-1, 5, 3).astype(np.float32), y
+
+    def test_dense_dropout(self, export, clf_data, session_kwargs):
+        X, y = clf_data
+        l = layers.InputLayer()
+        l = layers.DenseLayer(l, num_units=20)
+        l = layers.DropoutLayer(l)
+        l = layers.DenseLayer(l)
+        net = NeuralNetClassifier(l, session_kwargs=session_kwargs)
+        net.fit(X, y, epochs=2)
+
+        numpy_net = export(net)
+        assert np.allclose(
+            numpy_net.predict_proba(X), net.predict_proba(X), atol=1e-5)
+        assert (numpy_net.predict(X) == net.predict(X)).all()
+
+    def test_works_without_tensorflow(
+            self, export, clf_data, session_kwargs, tmpdir):
+        X, y = clf_data
+        l = layers.InputLayer()
+        l = layers.DenseLayer(l)
+        net = NeuralNetClassifier(l, session_kwargs=session_kwargs)
+        net.fit(X, y, epochs=1)
+        export(net)
+        np.save(str(tmpdir.join('X.npy')), X)
+
+        # block the tensorflow import, as if it was not installed
+        code = (
+            "import sys\n"
+            "sys.modules['tensorflow'] = None\n"
+            "import numpy as np\n"
+            "from mink.numpy_backend import NumpyNet\n"
+            "net = NumpyNet({net!r})\n"
+            "net.predict(np.load({X!r}))\n"
+        ).format(net=str(tmpdir.join('net.npz')),
+                 X=str(tmpdir.join('X.npy')))
+        # run from the directory that contains the mink package
+        cwd = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+        subprocess.check_call([sys.executable, '-c', code], cwd=cwd)
+
+    @pytest.mark.parametrize('padding', ['SAME', 'VALID'])
+    def test_conv_pool_concat(
+            self, export, image_data, session_kwargs, padding):
+        X, y = image_data
+        l0 = layers.InputLayer()
+        l1 = layers.Conv2DLayer(l0, num_filters=4, padding=padding)
+        l1 = layers.MaxPool2DLayer(l1, padding=padding)
+        l2 = layers.Conv2DLayer(l0, num_filters=3, filter_size=(2, 3),
+                                stride=2, padding=padding)
+        l2 = layers.MaxPool2DLayer(l2, pool_size=1, stride=1)
+        l = layers.ConcatLayer([l1, l2], axis=3)
+        l = layers.DenseLayer(l)
+        net = NeuralNetClassifier(l, session_kwargs=session_kwargs)
+        net.fit(X, y, epochs=2)
+
+        numpy_net = export(net)
+        assert np.allclose(
+            numpy_net.predict_proba(X), net.predict_proba(X), atol=1e-5)
+
+    @pytest.mark.parametrize('make_layer', [
+        lambda l: layers.RecurrentLayer(l),
+        lambda l: layers.LSTMLayer(l, num_units=10),
+        lambda l: layers.LSTMLayer(
+            l, num_units=10, use_peepholes=True, cell_clip=1.0),
+        lambda l: layers.GRULayer(l, num_units=10),
+    ])
+    def test_recurrent(self, export, sequence_data, session_kwargs,
+                       make_layer):
+        X, y = sequence_data
+        l = layers.InputLayer()
+        l = make_layer(l)
+        l = layers.DenseLayer(l)
+        net = NeuralNetClassifier(l, session_kwargs=session_kwargs)
+        net.fit(X, y, epochs=2)
+
+        numpy_net = export(net)
+        assert np.allclose(
+            numpy_net.predict_proba(X), net.predict_proba(X), atol=1e-5)
+
+    def test_regressor(self, export, regr_data, session_kwargs):
+        X, y = regr_data
+        l = layers.InputLayer()
+        l = layers.DenseLayer(l, num_units=20)
+        l = layers.DenseLayer(l)
+        net = NeuralNetRegressor(l, session_kwargs=session_kwargs)
+        net.fit(X, y, epochs=2)
+
+        numpy_net = export(net)
+        assert np.allclose(numpy_net.predict(X), net.predict(X), atol=1e-4)
+
+    def test_unsupported_layer_raises(self, export, image_data,
+                                      session_kwargs):
+        X, y = image_data
+        l = layers.InputLayer()
+        l = layers.ImageResizeLayer(l)
+        l = layers.DenseLayer(l)
+        net = NeuralNetClassifier(l, session_kwargs=session_kwargs)
+        net.fit(X, y, epochs=1)
+
+        with pytest.raises(ValueError):
+            export(net)
@@ -0,0 +1,127 @@
+# pylint: disable=invalid-name,missing-docstring,no-self-use
+# pylint: disable=old-style-class,no-init
+
+import numpy as np
+import pytest
+
+
+class TestParallelSearch:
+    @pytest.fixture
+    def search_cls(self):
+        from mink.search import ParallelSearch
+        return ParallelSearch
+
+    @pytest.fixture
+    def param_grid(self):
+        return {
+            'update__learning_rate': [0.001, 0.5],
+            'max_epochs': [2],
+        }
+
+    @pytest.fixture
+    def data(self, clf_data):
+        X, y = clf_data
+        return X[:300], y[:300]
+
+    @pytest.mark.parametrize('n_jobs', [1, 2])
+    def test_results(self, search_cls, clf_net, data, param_grid, n_jobs):
+        X, y = data
+        search = search_cls(
+            clf_net, param_grid, scoring='accuracy', cv=2, n_jobs=n_jobs)
+        search.fit(X, y)
+
+        results = search.cv_results_
+        assert len(results['params']) == 2
+        assert results['split0_test_score'].shape == (2,)
+        assert search.best_index_ == np.argmax(results['mean_test_score'])
+        assert search.best_params_ == results['params'][search.best_index_]
+        assert np.isclose(search.best_score_, results['mean_test_score'].max())
+        assert search.best_estimator_.predict(X).shape == y.shape
+
+    @pytest.mark.parametrize('n_jobs', [1, 2])
+    def test_train_histories(
+            self, search_cls, clf_net, data, param_grid, n_jobs):
+        X, y = data
+        search = search_cls(
+            clf_net, param_grid, cv=2, n_jobs=n_jobs, refit=False)
+        search.fit(X, y)
+
+        assert sorted(search.train_histories_) == [
+            (0, 0), (0, 1), (1, 0), (1, 1)]
+        for history in search.train_histories_.values():
+            assert [info['epoch'] for info in history] == [1, 2]
+            assert all('train loss' in info for info in history)
+
+    def test_session_threads_are_limited(self, session_kwargs):
+        from mink.search import _get_session_kwargs
+
+        kwargs = _get_session_kwargs(session_kwargs, 3)
+        config = kwargs['config']
+        assert config.intra_op_parallelism_threads == 3
+        assert config.inter_op_parallelism_threads == 3
+        # other options are kept, the original config is not changed
+        assert config.gpu_options.per_process_gpu_memory_fraction == 0.25
+        assert session_kwargs['config'].intra_op_parallelism_threads == 0
+
+
+class TestSuccessiveHalvingSearch:
+    @pytest.fixture
+    def search_cls(self):
+        from mink.search import SuccessiveHalvingSearch
+        return SuccessiveHalvingSearch
+
+    @pytest.fixture
+    def param_grid(self):
+        return {'update__learning_rate': [0.0, 0.001, 0.1, 0.5]}
+
+    def test_rungs(self, search_cls, clf_net, clf_data, param_grid):
+        X, y = clf_data
+        search = search_cls(
+            clf_net, param_grid, scoring='accuracy', min_epochs=1,
+            max_epochs=4, eta=2, random_state=0)
+        search.fit(X[:500], y[:500])
+
+        history = search.history_
+        assert [rung['epochs'] for rung in history] == [1, 2, 4]
+        assert [len(rung['candidates']) for rung in history] == [4, 2, 1]
+        for prev, rung in zip(history, history[1:]):
+            assert set(rung['candidates']) <= set(prev['candidates'])
+
+        assert search.best_index_ == history[-1]['candidates'][0]
+        # a learning rate of 0 does not learn anything
+        assert search.best_params_['update__learning_rate'] > 0.0
+        # survivors continue from their weights instead of restarting
+        assert len(search.best_estimator_.train_history_) == 4
+
+    def test_stops_at_max_epochs(
+            self, search_cls, clf_net, clf_data, param_grid):
+        X, y = clf_data
+        search = search_cls(
+            clf_net, param_grid, min_epochs=2, max_epochs=2, eta=2)
+        search.fit(X[:500], y[:500])
+
+        assert len(search.history_) == 1
+        assert len(search.history_[0]['candidates']) == 4
+
+    def test_default_scoring_uses_score_method(
+            self, search_cls, regr_net, regr_data):
+        from sklearn.model_selection import train_test_split
+        X, y = regr_data
+        X, y = X[:500], y[:500]
+        param_grid = {'update__learning_rate': [0.0001, 0.001]}
+        search = search_cls(
+            regr_net, param_grid, min_epochs=1, max_epochs=1,
+            random_state=0)
+        search.fit(X, y)
+
+        _, X_valid, _, y_valid = train_test_split(
+            X, y, test_size=search.validation_size, random_state=0)
+        assert np.isclose(
+            search.best_score_,
+            search.best_estimator_.score(X_valid, y_valid))
+
+    def test_invalid_eta_raises(
+            self, search_cls, clf_net, clf_data, param_grid):
+        X, y = clf_data
+        with pytest.raises(ValueError):
+            search_cls(clf_net, param_grid, eta=1).fit(X, y)
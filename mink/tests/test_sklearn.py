@@ -41,6 +41,20 @@ class TestSklearnCompatibility:
         from sklearn.utils.estimator_checks import check_estimator
         check_estimator(est)
 
+    def test_score_classifier(self, clf_net, clf_data):
+        from sklearn.metrics import accuracy_score
+        X, y = clf_data
+        clf_net.fit(X, y, epochs=1)
+        assert np.isclose(
+            clf_net.score(X, y), accuracy_score(y, clf_net.predict(X)))
+
+    def test_score_regressor(self, regr_net, regr_data):
+        from sklearn.metrics import r2_score
+        X, y = regr_data
+        regr_net.fit(X, y, epochs=1)
+        assert np.isclose(
+            regr_net.score(X, y), r2_score(y, regr_net.predict(X)))
+
     @slow
     def test_grid_search(self, clf_net, clf_data, param_grid):
         from sklearn.grid_search import GridSearchCV
@@ -100,3 +100,29 @@ class TestGetLayers:
 
         assert get_input_layers(D) == [G, J, K][::-1]
         assert get_input_layers(A) == [F, G, J, K][::-1]
+
+
+class TestGetLayerScopes:
+    @pytest.fixture
+    def get_layer_scopes(self):
+        from mink.utils import get_layer_scopes
+        return get_layer_scopes
+
+    def test_scopes_are_unique(self, get_layer_scopes):
+        l0 = layers.InputLayer()
+        l1 = layers.DenseLayer(l0)
+        l2 = layers.DenseLayer(l1, name='dense-1')
+        l3 = layers.DenseLayer(l2)
+
+        assert get_layer_scopes([l0, l1, l2, l3]) == [
+            'input', 'dense', 'dense-1', 'dense-2']
+
+    @pytest.mark.parametrize('name, expected', [
+        ('my layer', 'my_layer'),
+        ('_hidden', 'hidden'),
+        ('a/b:c', 'a_b_c'),
+        ('__', 'layer'),
+    ])
+    def test_scopes_are_valid_names(self, get_layer_scopes, name, expected):
+        layer = layers.DenseLayer(name=name)
+        assert get_layer_scopes([layer]) == [expected]
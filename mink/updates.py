@@ -3,6 +3,8 @@
 from sklearn.base import BaseEstimator
 import tensorflow as tf
 
+from mink.utils import add_hyperparam
+
 
 __all__ = [
     'SGD',
@@ -15,18 +17,33 @@ __all__ = [
 
 
 class Update(BaseEstimator):
-    def __call__(self, Xs):
+    """Base class of the updates.
+
+    Learning rates (and momentum) are hyperparameters of the graph,
+    i.e. they can be changed with `set_params` after the net was
+    initialized.
+
+    """
+    def get_optimizer(self):
         raise NotImplementedError
 
+    def __call__(self, loss):
+        train_step = self.get_optimizer().minimize(loss)
+        return train_step
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('hyperparams_', None)
+        return state
+
 
 class SGD(Update):
     def __init__(self, learning_rate=0.01):
         self.learning_rate = learning_rate
 
-    def __call__(self, loss):
-        train_step = tf.train.GradientDescentOptimizer(
-            self.learning_rate).minimize(loss)
-        return train_step
+    def get_optimizer(self):
+        return tf.train.GradientDescentOptimizer(
+            add_hyperparam(self, 'learning_rate'))
 
 
 class Momentum(Update):
@@ -38,12 +55,11 @@ class Momentum(Update):
         self.learning_rate = learning_rate
         self.momentum = momentum
 
-    def __call__(self, loss):
-        train_step = tf.train.MomentumOptimizer(
-            learning_rate=self.learning_rate,
-            momentum=self.momentum,
-        ).minimize(loss)
-        return train_step
+    def get_optimizer(self):
+        return tf.train.MomentumOptimizer(
+            learning_rate=add_hyperparam(self, 'learning_rate'),
+            momentum=add_hyperparam(self, 'momentum'),
+        )
 
 
 class Adam(Update):
@@ -57,13 +73,12 @@ class Adam(Update):
         self.beta1 = beta1
         self.beta2 = beta2
 
-    def __call__(self, loss):
-        train_step = tf.train.AdamOptimizer(
-            learning_rate=self.learning_rate,
+    def get_optimizer(self):
+        return tf.train.AdamOptimizer(
+            learning_rate=add_hyperparam(self, 'learning_rate'),
             beta1=self.beta1,
             beta2=self.beta2,
-        ).minimize(loss)
-        return train_step
+        )
 
 
 class Adadelta(Update):
@@ -75,23 +90,21 @@ class Adadelta(Update):
         self.learning_rate = learning_rate
         self.rho = rho
 
-    def __call__(self, loss):
-        train_step = tf.train.AdadeltaOptimizer(
-            learning_rate=self.learning_rate,
+    def get_optimizer(self):
+        return tf.train.AdadeltaOptimizer(
+            learning_rate=add_hyperparam(self, 'learning_rate'),
             rho=self.rho,
-        ).minimize(loss)
-        return train_step
+        )
 
 
 class Adagrad(Update):
     def __init__(self, learning_rate=1.0):
         self.learning_rate = learning_rate
 
-    def __call__(self, loss):
-        train_step = tf.train.AdadeltaOptimizer(
-            learning_rate=self.learning_rate,
-        ).minimize(loss)
-        return train_step
+    def get_optimizer(self):
+        return tf.train.AdadeltaOptimizer(
+            learning_rate=add_hyperparam(self, 'learning_rate'),
+        )
 
 
 class RMSProp(Update):
@@ -105,10 +118,9 @@ class RMSProp(Update):
         self.decay = decay
         self.momentum = momentum
 
-    def __call__(self, loss):
-        train_step = tf.train.RMSPropOptimizer(
-            learning_rate=self.learning_rate,
+    def get_optimizer(self):
+        return tf.train.RMSPropOptimizer(
+            learning_rate=add_hyperparam(self, 'learning_rate'),
             decay=self.decay,
-            momentum=self.momentum
-        ).minimize(loss)
-        return train_step
+            momentum=add_hyperparam(self, 'momentum'),
+        )
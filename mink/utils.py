@@ -1,5 +1,8 @@
 """Contains base utilities that don't depend on other modules."""
 
+from contextlib import contextmanager
+import re
+
 import numpy as np
 import tensorflow as tf
 
@@ -150,3 +153,78 @@ def get_layer_name(layer):
     if name.endswith('Layer'):
         name = name[:-5]
     return name.lower()
+
+
+def get_layer_scopes(layers):
+    """Return a unique name scope for each of the layers, derived from
+    their names.
+
+    Characters that tensorflow does not allow in names are replaced by
+    underscores. Layers with the same name are numbered, e.g. 'dense',
+    'dense-1', 'dense-2'.
+
+    """
+    scopes = []
+    for layer in layers:
+        name = re.sub(r'[^A-Za-z0-9_.\-]', '_', get_layer_name(layer))
+        name = re.sub(r'^[_\-]+', '', name) or 'layer'
+        scope, i = name, 0
+        while scope in scopes:
+            i += 1
+            scope = '{}-{}'.format(name, i)
+        scopes.append(scope)
+    return scopes
+
+
+@contextmanager
+def layer_scope(layer):
+    """Build the ops and variables of the layer inside its scope.
+
+    The scope is `layer.scope_`, as set by the net, or else derived
+    from the name of the layer. The name scope is entered as is, so
+    that all ops of a layer share it, even if they are built in several
+    calls.
+
+    """
+    scope = getattr(layer, 'scope_', None) or get_layer_scopes([layer])[0]
+    # the variable scope names the variables created by tensorflow
+    # itself, e.g. those of recurrent cells
+    with tf.variable_scope(scope):
+        with tf.name_scope(scope + '/'):
+            yield scope
+
+
+def add_hyperparam(obj, name, dtype=tf.float32):
+    """Represent the hyperparameter `name` of `obj` in the graph.
+
+    Returns a scalar placeholder that defaults to the current value of
+    the attribute. The net feeds the then current value whenever it
+    trains, so that the hyperparameter can be changed through
+    `set_params` without building the graph anew. The placeholder is
+    created once per graph and stored in `obj.hyperparams_`.
+
+    """
+    hyperparams = obj.__dict__.setdefault('hyperparams_', {})
+    placeholder = hyperparams.get(name)
+    if (placeholder is None) or (
+            placeholder.graph is not tf.get_default_graph()):
+        placeholder = tf.placeholder_with_default(
+            tf.constant(getattr(obj, name), dtype=dtype),
+            shape=[],
+            name=name,
+        )
+        hyperparams[name] = placeholder
+    return placeholder
+
+
+def get_hyperparams(objs, graph):
+    """Return (object, name, placeholder) tuples for all
+    hyperparameters of the objects that live in the given graph.
+
+    """
+    hyperparams = []
+    for obj in objs:
+        for name, placeholder in getattr(obj, 'hyperparams_', {}).items():
+            if placeholder.graph is graph:
+                hyperparams.append((obj, name, placeholder))
+    return hyperparams